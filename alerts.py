@@ -0,0 +1,234 @@
+"""Rate-alert subscriptions: SQLite persistence, threshold index and notification queue."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from rates import RatesMatrix
+from throttling import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ABOVE = ">"
+BELOW = "<"
+
+Pair = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class Alert:
+    id: int
+    chat_id: int
+    base: str
+    target: str
+    direction: str
+    threshold: float
+    created_at: float
+
+    def describe(self) -> str:
+        return f"{self.base} → {self.target} {self.direction} {self.threshold:g}"
+
+
+class AlertIndex:
+    """Per-pair sorted threshold arrays.
+
+    ``above[pair]`` holds ``(threshold, id)`` sorted ascending, so every alert
+    triggered by a rate ``r`` is the prefix ``threshold < r`` found with one
+    bisect; ``below[pair]`` is the mirrored suffix ``threshold > r``.  Matching
+    costs O(log n + k) per pair for k triggered alerts, independent of how
+    many alerts stay untouched.
+    """
+
+    def __init__(self) -> None:
+        self._above: Dict[Pair, List[Tuple[float, int]]] = defaultdict(list)
+        self._below: Dict[Pair, List[Tuple[float, int]]] = defaultdict(list)
+        self._alerts: Dict[int, Alert] = {}
+        self._by_chat: Dict[int, Set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    def _bucket(self, alert: Alert) -> List[Tuple[float, int]]:
+        table = self._above if alert.direction == ABOVE else self._below
+        return table[(alert.base, alert.target)]
+
+    def add(self, alert: Alert) -> None:
+        insort(self._bucket(alert), (alert.threshold, alert.id))
+        self._alerts[alert.id] = alert
+        self._by_chat[alert.chat_id].add(alert.id)
+
+    def remove(self, alert_id: int) -> Optional[Alert]:
+        alert = self._alerts.pop(alert_id, None)
+        if alert is None:
+            return None
+        bucket = self._bucket(alert)
+        position = bisect_left(bucket, (alert.threshold, alert.id))
+        if position < len(bucket) and bucket[position][1] == alert.id:
+            del bucket[position]
+        self._forget_chat(alert)
+        return alert
+
+    def _forget_chat(self, alert: Alert) -> None:
+        ids = self._by_chat.get(alert.chat_id)
+        if ids is not None:
+            ids.discard(alert.id)
+            if not ids:
+                del self._by_chat[alert.chat_id]
+
+    def for_chat(self, chat_id: int) -> List[Alert]:
+        return sorted((self._alerts[alert_id] for alert_id in self._by_chat.get(chat_id, ())), key=lambda a: a.id)
+
+    def match(self, pair: Pair, rate: float) -> List[Alert]:
+        """Pop and return every alert of *pair* triggered by *rate*."""
+
+        triggered: List[Tuple[float, int]] = []
+        above = self._above.get(pair)
+        if above:
+            cut = bisect_left(above, (rate,))
+            triggered.extend(above[:cut])
+            del above[:cut]
+        below = self._below.get(pair)
+        if below:
+            cut = bisect_right(below, (rate, float("inf")))
+            triggered.extend(below[cut:])
+            del below[cut:]
+
+        alerts = []
+        for _, alert_id in triggered:
+            alert = self._alerts.pop(alert_id)
+            self._forget_chat(alert)
+            alerts.append(alert)
+        return alerts
+
+    def match_rates(self, rates: RatesMatrix) -> List[Alert]:
+        triggered: List[Alert] = []
+        for pair in set(self._above) | set(self._below):
+            rate = rates.get(pair[0], {}).get(pair[1])
+            if rate is not None:
+                triggered.extend(self.match(pair, rate))
+        return triggered
+
+
+class AlertStore:
+    """SQLite table of active alerts; triggered alerts are deleted."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS alerts ("
+                "id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, base TEXT NOT NULL, "
+                "target TEXT NOT NULL, direction TEXT NOT NULL, threshold REAL NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS alerts_chat ON alerts (chat_id)")
+            self._conn = conn
+        return self._conn
+
+    def load(self) -> List[Alert]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, chat_id, base, target, direction, threshold, created_at FROM alerts"
+            ).fetchall()
+        return [Alert(*row) for row in rows]
+
+    def add(self, chat_id: int, base: str, target: str, direction: str, threshold: float) -> Alert:
+        created_at = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO alerts (chat_id, base, target, direction, threshold, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (chat_id, base, target, direction, threshold, created_at),
+                )
+        return Alert(cursor.lastrowid, chat_id, base, target, direction, threshold, created_at)
+
+    def delete(self, alert_ids: Iterable[int]) -> None:
+        ids = [(alert_id,) for alert_id in alert_ids]
+        if not ids:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("DELETE FROM alerts WHERE id = ?", ids)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class NotificationSender:
+    """Queue of outgoing messages drained under a global token bucket.
+
+    ``send`` is called as ``send(chat_id, text)``.  Exceptions carrying a
+    ``retry_after`` attribute (Telegram flood control) pause the queue and the
+    message is retried; other errors are logged and the message is dropped.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[int, str], Awaitable[object]],
+        *,
+        rate: float = 25.0,
+        burst: float = 25.0,
+    ) -> None:
+        self._send = send
+        self.bucket = TokenBucket(rate, burst)
+        self._queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def enqueue(self, chat_id: int, text: str) -> None:
+        self._queue.put_nowait((chat_id, text))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            chat_id, text = await self._queue.get()
+            await self.bucket.acquire()
+            try:
+                await self._send(chat_id, text)
+            except Exception as exc:  # noqa: BLE001
+                retry_after = getattr(exc, "retry_after", None)
+                if retry_after is None:
+                    logger.warning("Не удалось отправить уведомление в чат %s: %s", chat_id, exc, extra={"chat_id": chat_id})
+                    continue
+                delay = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                await asyncio.sleep(delay)
+                self._queue.put_nowait((chat_id, text))
+
+
+def group_by_chat(alerts: Iterable[Alert]) -> Dict[int, List[Alert]]:
+    grouped: Dict[int, List[Alert]] = defaultdict(list)
+    for alert in alerts:
+        grouped[alert.chat_id].append(alert)
+    return grouped
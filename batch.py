@@ -0,0 +1,149 @@
+"""Parsing and conversion of many amounts at once (pasted lists and CSV uploads)."""
+from __future__ import annotations
+
+import csv
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from money import format_money, to_decimal
+
+# Newlines, semicolons, tabs and "comma + space" separate amounts; a bare comma
+# between digits stays a decimal separator, so "1,5" is still one and a half.
+_SEPARATORS_RE = re.compile(r"[\n;\t]+|,\s+")
+# Spaces (also non-breaking) and apostrophes group thousands only inside a
+# well-formed number: "12 000", "1 234,56", "1'000.5".
+_THOUSANDS_RE = re.compile(r"^\d{1,3}(?:[ \u00a0']\d{3})+(?:[.,]\d+)?$")
+_GROUP_RE = re.compile(r"[ \u00a0']")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def parse_number(value: str) -> Optional[Decimal]:
+    cleaned = value.strip()
+    if _THOUSANDS_RE.match(cleaned):
+        cleaned = _GROUP_RE.sub("", cleaned)
+    elif _GROUP_RE.search(cleaned):
+        return None
+    cleaned = cleaned.replace(",", ".")
+    if not cleaned:
+        return None
+    return to_decimal(cleaned)
+
+
+def _is_grouped_number(token: str) -> bool:
+    """Whether the spaces in *token* group thousands rather than separate amounts.
+
+    "12 000", "1 000 000" and "1 234,56" are one amount; "100 200 300" is
+    three.  Plain spaces between several three-digit groups are read as a
+    list unless a group cannot stand alone ("000") or a decimal part follows.
+    """
+
+    if not _THOUSANDS_RE.match(token):
+        return False
+    integer = re.split(r"[.,]", token, maxsplit=1)[0]
+    separators = _GROUP_RE.findall(integer)
+    if len(separators) == 1 or len(integer) < len(token) or set(separators) != {" "}:
+        return True
+    return any(group.startswith("0") for group in integer.split(" ")[1:])
+
+
+def parse_amounts(text: str) -> List[Decimal]:
+    """Parse one or more amounts from a message; raises ``ValueError`` naming the bad token."""
+
+    amounts = []
+    for token in _SEPARATORS_RE.split(text.strip()):
+        token = token.strip().rstrip(",.")
+        if not token:
+            continue
+        parts = [token] if _is_grouped_number(token) else _WHITESPACE_RE.split(token)
+        for part in parts:
+            number = parse_number(part)
+            if number is None:
+                raise ValueError(part)
+            amounts.append(number)
+    if not amounts:
+        raise ValueError(text)
+    return amounts
+
+
+def _sniff_delimiter(line: str) -> str:
+    for delimiter in (";", "\t", ","):
+        if delimiter in line:
+            return delimiter
+    return ","
+
+
+def iter_csv_amounts(lines: Iterable[str]) -> Iterator[Tuple[int, Decimal]]:
+    """Yield ``(row number, amount)`` for every row whose first numeric cell is an amount.
+
+    Rows are read lazily, so arbitrarily large files are processed in constant memory.
+    Header rows and rows without a number are skipped.
+    """
+
+    iterator = iter(lines)
+    first = next(iterator, None)
+    if first is None:
+        return
+    delimiter = _sniff_delimiter(first)
+
+    def _chain() -> Iterator[str]:
+        yield first
+        yield from iterator
+
+    for row_number, row in enumerate(csv.reader(_chain(), delimiter=delimiter), start=1):
+        for cell in row:
+            number = parse_number(cell)
+            if number is not None:
+                yield row_number, number
+                break
+
+
+@dataclass
+class BatchTotals:
+    count: int = 0
+    amount: Decimal = field(default_factory=Decimal)
+    result: Decimal = field(default_factory=Decimal)
+
+
+def convert_amounts(
+    amounts: Iterable[Decimal],
+    convert: Callable[[Decimal], Decimal],
+    totals: BatchTotals,
+) -> Iterator[Tuple[Decimal, Decimal]]:
+    """Lazily convert *amounts*, accumulating exact totals as they stream through."""
+
+    for amount in amounts:
+        result = convert(amount)
+        totals.count += 1
+        totals.amount += amount
+        totals.result += result
+        yield amount, result
+
+
+def format_totals(base: str, target: str, totals: BatchTotals) -> str:
+    return (
+        f"Итого ({totals.count}): {format_money(totals.amount, base)} {base} = "
+        f"{format_money(totals.result, target)} {target}"
+    )
+
+
+def format_batch_table(rows: Iterable[Tuple[Decimal, Decimal]], base: str, target: str, totals: BatchTotals) -> str:
+    lines = [f"{format_money(amount, base)} {base} = {result} {target}" for amount, result in rows]
+    lines.append("━━━━━━━━━━━━━━━━━━━━━━")
+    lines.append(format_totals(base, target, totals))
+    return "\n".join(lines)
+
+
+def write_batch_csv(
+    rows: Iterable[Tuple[Decimal, Decimal]],
+    handle: TextIO,
+    base: str,
+    target: str,
+    totals: BatchTotals,
+) -> None:
+    writer = csv.writer(handle)
+    writer.writerow([base, target])
+    for amount, result in rows:
+        writer.writerow([format_money(amount, base), str(result)])
+    writer.writerow([format_money(totals.amount, base), format_money(totals.result, target), "Итого"])
@@ -0,0 +1,773 @@
+"""Offline load test of the bot: the real Application against a fake Bot API and a local rates API.
+
+Every synthetic user goes through ``/start`` → base currency → target currency
+→ amount.  Users arrive at ``--rate`` per second; each step is measured from
+handing the update to the Application until its handler has finished.
+
+    python bench_bot.py --users 2000 --rate 200 --concurrency 64
+    python bench_bot.py --workers 4 --users 2000 --rate 200
+    python bench_bot.py --transport compare --users 2000 --rate 200
+    python bench_bot.py --micro
+
+Nothing leaves the machine: the bot token and API key are fake, every Bot API
+call is answered in-process and the rates come from a stub HTTP server.  With
+``--workers`` or ``--transport polling|webhook`` the bot runs as real
+processes (a leader and N workers, or one process) that talk to a local Bot
+API served by this script; a step is then measured from queueing the update
+for ``getUpdates`` — or posting it to the bot's webhook — until the bot's
+reply arrives.  ``--transport compare`` runs both and prints p50/p99 side by
+side.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import urllib.parse
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from currencies import SUPPORTED_CURRENCIES
+
+STEPS = ("start", "base", "target", "amount")
+
+
+# --- Local stand-ins for Telegram and exchangerate-api.com ---------------------------
+
+
+def _stub_quotes(seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    quotes = {code: round(rng.uniform(0.2, 5000.0), 4) for code in SUPPORTED_CURRENCIES}
+    quotes.update(USD=1.0, EUR=0.9213, RUB=92.4567, CNY=7.1834)
+    return quotes
+
+
+class RatesApiStub:
+    """Serves ``GET /v6/<key>/latest/<base>`` in the exchangerate-api.com v6 format."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.requests = 0
+        self.port = 0
+        self._body = json.dumps({"result": "success", "conversion_rates": _stub_quotes(17)}).encode()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(self._body)}\r\n\r\n".encode()
+                    + self._body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _fake_bot_request_class():
+    from telegram.request import BaseRequest
+
+    class FakeBotRequest(BaseRequest):
+        """Answers Bot API calls in-process after ``latency`` seconds, like a very fast Telegram."""
+
+        def __init__(self, latency: float) -> None:
+            self.latency = latency
+            self.calls: Counter = Counter()
+            self._message_ids = itertools.count(1_000_000)
+
+        async def initialize(self) -> None:
+            return None
+
+        async def shutdown(self) -> None:
+            return None
+
+        @property
+        def read_timeout(self) -> Optional[float]:
+            return None
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                             connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+            endpoint = url.rsplit("/", 1)[-1]
+            self.calls[endpoint] += 1
+            parameters: Dict[str, Any] = {}
+            if request_data is not None:
+                request_data.json_parameters  # serialize like the real transport does
+                parameters = request_data.parameters
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return 200, json.dumps({"ok": True, "result": self._result(endpoint, parameters)}).encode()
+
+        def _result(self, endpoint: str, parameters: Dict[str, Any]) -> Any:
+            if endpoint == "getMe":
+                return {
+                    "id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": True,
+                }
+            if endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+                chat_id = int(parameters.get("chat_id", 1))
+                return {
+                    "message_id": int(parameters.get("message_id", next(self._message_ids))),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": parameters.get("text", ""),
+                }
+            return True
+
+    return FakeBotRequest
+
+
+# --- Synthetic users -----------------------------------------------------------------
+
+
+class UpdateFactory:
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Dict[str, Any]:
+        update_id = next(self._ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, data: str) -> Dict[str, Any]:
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                    "text": "menu",
+                },
+            },
+        }
+
+
+def _percentile(ordered: Sequence[float], quantile: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+def _bot_environment(args: argparse.Namespace, data_dir: str, stub: RatesApiStub) -> Dict[str, str]:
+    return {
+        "BOT_TOKEN": "123456:bench",
+        "API_KEY": "bench",
+        "DATA_DIR": data_dir,
+        "RATE_PROVIDERS": "exchangerate-api",
+        "EXCHANGERATE_API_URL": f"http://127.0.0.1:{stub.port}/v6",
+        "UPDATE_CONCURRENCY": str(args.concurrency),
+        "TELEGRAM_SEND_RATE": str(args.send_rate),
+        "WORKERS": str(args.workers),
+        "METRICS_PORT": "0",
+    }
+
+
+Step = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+async def _drive_users(
+    args: argparse.Namespace, step: Step, currencies: Sequence[str], favorites: Sequence[str]
+) -> Tuple[List[object], float]:
+    """Start ``args.users`` flows at ``args.rate`` per second; return their outcomes and the wall time."""
+
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+
+    async def user_flow(user_id: int) -> None:
+        pool = currencies if rng.random() < args.all_currencies else favorites
+        base = rng.choice(pool)
+        target = rng.choice([code for code in favorites if code != base] or [c for c in currencies if c != base])
+        await step("start", factory.message(user_id, "/start"))
+        await step("base", factory.callback(user_id, f"base:{base}"))
+        await step("target", factory.callback(user_id, f"target:{base}:{target}"))
+        await step("amount", factory.message(user_id, f"{rng.uniform(1, 100000):.2f}"))
+
+    flows: List[asyncio.Task] = []
+    started = time.perf_counter()
+    for index in range(args.users):
+        if args.rate:
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        flows.append(asyncio.get_running_loop().create_task(user_flow(10_000 + index)))
+    outcomes = await asyncio.gather(*flows, return_exceptions=True)
+    return outcomes, time.perf_counter() - started
+
+
+def _load_report(
+    args: argparse.Namespace, latencies: Dict[str, List[float]], outcomes: List[object], elapsed: float
+) -> Dict[str, Any]:
+    all_latencies = sorted(value for values in latencies.values() for value in values)
+    report: Dict[str, Any] = {
+        "users": args.users,
+        "transport": args.transport,
+        "workers": args.workers,
+        "failed_flows": sum(isinstance(outcome, BaseException) for outcome in outcomes),
+        "handler_errors": None,
+        "elapsed_s": elapsed,
+        "flows_per_s": args.users / elapsed,
+        "updates_per_s": len(all_latencies) / elapsed,
+        "latency_ms": {},
+        "peak_rss_mb": None,
+        "tracemalloc_peak_mb": None,
+    }
+    for name, values in [*((name, sorted(latencies[name])) for name in STEPS), ("all", all_latencies)]:
+        report["latency_ms"][name] = {
+            "count": len(values),
+            "p50": _percentile(values, 0.50) * 1000,
+            "p95": _percentile(values, 0.95) * 1000,
+            "p99": _percentile(values, 0.99) * 1000,
+            "max": (values[-1] if values else 0.0) * 1000,
+        }
+    return report
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = RatesApiStub(args.api_latency)
+    await stub.start()
+    data_dir = tempfile.TemporaryDirectory(prefix="exchange_bot_bench_")
+    os.environ.update(_bot_environment(args, data_dir.name, stub))
+    import exchange_bot  # noqa: E402  (reads its configuration from the environment above)
+    from metrics import HANDLER_ERRORS
+    from telegram import Update
+
+    transport = _fake_bot_request_class()(args.bot_latency)
+    application = exchange_bot.prepare_application(transport)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors_before = HANDLER_ERRORS.total()
+
+    async def step(name: str, payload: Dict[str, Any]) -> None:
+        update = Update.de_json(payload, application.bot)
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[name].append(time.perf_counter() - started)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    outcomes, elapsed = await _drive_users(
+        args, step, exchange_bot.CURRENCIES, exchange_bot.DEFAULT_FAVORITES or exchange_bot.CURRENCIES
+    )
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    await stub.stop()
+    data_dir.cleanup()
+
+    report = _load_report(args, latencies, outcomes, elapsed)
+    report.update(
+        handler_errors=int(HANDLER_ERRORS.total() - errors_before),
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        tracemalloc_peak_mb=traced_peak / 2**20 if traced_peak is not None else None,
+        bot_api_calls=dict(transport.calls),
+        rates_api_calls=stub.requests,
+    )
+    return report
+
+
+# --- Multi-worker mode: real processes against a local Bot API ------------------------
+
+
+class FakeTelegramServer:
+    """Minimal Bot API over HTTP: serves queued updates to ``getUpdates`` and records replies.
+
+    ``push`` queues an update; the future returned by ``expect_reply`` resolves
+    when the bot sends or edits a message in that chat.
+    """
+
+    def __init__(self) -> None:
+        self.port = 0
+        self.calls: Counter = Counter()
+        self._updates: List[Dict[str, Any]] = []
+        self._arrived = asyncio.Event()
+        self._replies: Dict[int, "asyncio.Future[None]"] = {}
+        self._message_ids = itertools.count(1_000_000)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        # Wake pending long polls so every connection finishes instead of being cancelled.
+        self._arrived.set()
+        if self._connections:
+            await asyncio.wait(self._connections, timeout=5)
+
+    def push(self, update: Dict[str, Any]) -> None:
+        self._updates.append(update)
+        self._arrived.set()
+
+    def expect_reply(self, chat_id: int) -> "asyncio.Future[None]":
+        future = self._replies[chat_id] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                endpoint = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                if headers.get("content-type", "").startswith("application/json"):
+                    parameters = json.loads(body or b"{}")
+                else:
+                    parameters = dict(urllib.parse.parse_qsl(body.decode("utf-8")))
+                payload = json.dumps({"ok": True, "result": await self._call(endpoint, parameters)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _call(self, endpoint: str, parameters: Dict[str, Any]) -> Any:
+        self.calls[endpoint] += 1
+        if endpoint == "getUpdates":
+            offset = int(parameters.get("offset") or 0)
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            if not self._updates and self._server.is_serving():
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), float(parameters.get("timeout") or 0))
+                except asyncio.TimeoutError:
+                    pass
+            return self._updates[: int(parameters.get("limit") or 100)]
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if endpoint in ("sendMessage", "editMessageText"):
+            chat_id = int(parameters.get("chat_id", 0))
+            future = self._replies.pop(chat_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+            return {
+                "message_id": int(parameters.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": parameters.get("text", ""),
+            }
+        return True
+
+
+class WebhookClient:
+    """Posts updates to the bot's webhook over a pool of keep-alive connections, like Telegram does."""
+
+    def __init__(self, port: int, path: str, secret: str, connections: int = 40) -> None:
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.size = connections
+        self._idle: "asyncio.Queue[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]" = asyncio.Queue()
+        self._opened = 0
+
+    async def post(self, update: Dict[str, Any]) -> int:
+        if self._idle.empty() and self._opened < self.size:
+            self._opened += 1
+            connection = await asyncio.open_connection("127.0.0.1", self.port)
+        else:
+            connection = await self._idle.get()
+        reader, writer = connection
+        body = json.dumps(update).encode()
+        writer.write(
+            f"POST {self.path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {self.secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        self._idle.put_nowait(connection)
+        return status
+
+    async def close(self) -> None:
+        while not self._idle.empty():
+            _, writer = self._idle.get_nowait()
+            writer.close()
+
+
+async def _http_status(port: int, path: str) -> Optional[int]:
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return None
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        return int(status_line.split()[1]) if status_line else None
+    except (OSError, ValueError, IndexError):
+        return None
+    finally:
+        writer.close()
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _peak_rss_mb(pids: Sequence[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii") as handle:
+                total += next(int(line.split()[1]) for line in handle if line.startswith("VmHWM:"))
+        except (OSError, StopIteration):
+            continue
+    return total / 1024
+
+
+async def run_processes(args: argparse.Namespace, transport: str) -> Dict[str, Any]:
+    """Run ``exchange_bot.py`` (with ``WORKERS`` processes) against the local Bot API and rates stub.
+
+    With *transport* ``polling`` updates are handed out through ``getUpdates``;
+    with ``webhook`` they are posted to the bot's webhook server instead.
+    """
+
+    from cluster import SharedSnapshot, read_status
+    from currencies import SUPPORTED_CURRENCIES as currencies
+
+    args = argparse.Namespace(**{**vars(args), "transport": transport})
+    stub = RatesApiStub(args.api_latency)
+    telegram = FakeTelegramServer()
+    await stub.start()
+    await telegram.start()
+    data_dir = tempfile.TemporaryDirectory(prefix="exchange_bot_bench_")
+    env = {
+        **os.environ,
+        **_bot_environment(args, data_dir.name, stub),
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram.port}/bot",
+        "LOG_LEVEL": "WARNING",
+    }
+    webhook: Optional[WebhookClient] = None
+    if transport == "webhook":
+        webhook = WebhookClient(_free_port(), "/telegram", "bench")
+        env.update(
+            WEBHOOK_URL="https://bench.invalid",
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(webhook.port),
+            WEBHOOK_PATH=webhook.path,
+            WEBHOOK_SECRET=webhook.secret,
+        )
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, str(Path(__file__).resolve().with_name("exchange_bot.py")), env=env
+    )
+    status_path = Path(data_dir.name) / "cluster.json"
+
+    async def ready() -> bool:
+        if args.workers:
+            status = read_status(status_path)
+            if not status or not all(worker["connected"] for worker in status["workers"]):
+                return False
+            shared = SharedSnapshot.open(Path(data_dir.name) / "rates.mmap")
+            published = shared.version()
+            shared.close()
+            if not published:
+                return False
+        elif not stub.requests:
+            return False
+        if webhook is not None:
+            return await _http_status(webhook.port, "/readyz") == 200
+        return telegram.calls["getUpdates"] > 0
+
+    try:
+        deadline = time.monotonic() + 60
+        while not await ready():
+            if bot.returncode is not None or time.monotonic() > deadline:
+                raise RuntimeError("бот не запустился, см. вывод выше")
+            await asyncio.sleep(0.2)
+        if args.workers:
+            await asyncio.sleep(1.5)  # let every worker pick up the published rates
+
+        latencies: Dict[str, List[float]] = defaultdict(list)
+
+        async def step(name: str, payload: Dict[str, Any]) -> None:
+            body = payload.get("message") or payload["callback_query"]
+            reply = telegram.expect_reply(body["from"]["id"])
+            started = time.perf_counter()
+            if webhook is not None:
+                status = await webhook.post(payload)
+                if status != 200:
+                    raise RuntimeError(f"webhook ответил {status}")
+            else:
+                telegram.push(payload)
+            await asyncio.wait_for(reply, 30)
+            latencies[name].append(time.perf_counter() - started)
+
+        favorites = [code for code in ("RUB", "USD", "EUR", "CNY") if code in currencies]
+        outcomes, elapsed = await _drive_users(args, step, currencies, favorites)
+        status = read_status(status_path) or {"workers": []}
+        pids = [bot.pid] + [worker["pid"] for worker in status["workers"] if worker["pid"]]
+        report = _load_report(args, latencies, outcomes, elapsed)
+        report.update(peak_rss_mb=_peak_rss_mb(pids), bot_api_calls=dict(telegram.calls), rates_api_calls=stub.requests)
+        bot.terminate()
+        await bot.wait()
+        # The leader writes its final counters on shutdown.
+        status = read_status(status_path) or {"workers": []}
+        report["routed"] = [worker["routed"] for worker in status["workers"]]
+        return report
+    finally:
+        if webhook is not None:
+            await webhook.close()
+        if bot.returncode is None:
+            bot.terminate()
+            await bot.wait()
+        await telegram.stop()
+        await stub.stop()
+        data_dir.cleanup()
+
+
+async def compare_transports(args: argparse.Namespace) -> Dict[str, Any]:
+    """The same load through ``getUpdates`` and through the webhook, one after the other."""
+
+    return {transport: await run_processes(args, transport) for transport in ("polling", "webhook")}
+
+
+def print_transport_comparison(reports: Dict[str, Dict[str, Any]]) -> None:
+    for transport, report in reports.items():
+        print(f"=== {transport} ===")
+        print_load_report(report)
+    print(f"{'доставка':<9} {'p50 мс':>8} {'p99 мс':>8} {'обновлений/с':>13}")
+    for transport, report in reports.items():
+        row = report["latency_ms"]["all"]
+        print(f"{transport:<9} {row['p50']:>8.2f} {row['p99']:>8.2f} {report['updates_per_s']:>13.1f}")
+
+
+def print_load_report(report: Dict[str, Any]) -> None:
+    errors = "—" if report["handler_errors"] is None else report["handler_errors"]
+    if report["transport"] != "inprocess":
+        print(f"Доставка обновлений: {report['transport']}")
+    if report["workers"]:
+        print(f"Воркеров: {report['workers']}, обновлений на воркер: {report.get('routed')}")
+    print(
+        f"Пользователей: {report['users']} (сбоев {report['failed_flows']}, ошибок обработчиков "
+        f"{errors}) за {report['elapsed_s']:.2f} с — {report['flows_per_s']:.1f} сценариев/с, "
+        f"{report['updates_per_s']:.1f} обновлений/с"
+    )
+    print(f"{'шаг':<8} {'кол-во':>7} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'макс мс':>8}")
+    for name, row in report["latency_ms"].items():
+        print(f"{name:<8} {row['count']:>7} {row['p50']:>8.2f} {row['p95']:>8.2f} {row['p99']:>8.2f} {row['max']:>8.2f}")
+    memory = f"Память: пиковый RSS {report['peak_rss_mb']:.1f} МБ" + (
+        " (все процессы бота)" if report["transport"] != "inprocess" else ""
+    )
+    if report["tracemalloc_peak_mb"] is not None:
+        memory += f", пик tracemalloc {report['tracemalloc_peak_mb']:.1f} МБ"
+    print(memory)
+    print("Вызовы Bot API: " + ", ".join(f"{name} {count}" for name, count in sorted(report["bot_api_calls"].items())))
+    print(f"Запросов к API курсов: {report['rates_api_calls']}")
+
+
+# --- Micro benchmarks of the hot paths -------------------------------------------------
+
+
+def run_micro(number: int) -> Dict[str, float]:
+    """Nanoseconds per call of the hot paths, next to the naive alternatives they replaced."""
+
+    from decimal import Decimal
+
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ.setdefault("API_KEY", "bench")
+    import exchange_bot  # noqa: E402  (reads its configuration from the environment above)
+    from alerts import ABOVE, BELOW, Alert, AlertIndex
+    from money import ConversionTable
+    from query_parser import parse_query
+    from rates import RateSnapshot, build_cross_matrix
+
+    codes = list(SUPPORTED_CURRENCIES)
+    quotes = _stub_quotes(17)
+    matrix = build_cross_matrix(quotes, codes)
+    rate = matrix["USD"]["RUB"]
+    convert = ConversionTable(matrix).converter("USD", "RUB")
+    amount = Decimal("12345.67")
+    float_amount = float(amount)
+
+    rng = random.Random(1)
+    pairs = [("USD", "RUB"), ("EUR", "RUB"), ("CNY", "RUB"), ("USD", "EUR")]
+    # Alerts far from the current rates: a refresh checks all of them and triggers none.
+    alerts = []
+    for alert_id in range(100_000):
+        base, target = rng.choice(pairs)
+        current = matrix[base][target]
+        direction = rng.choice((ABOVE, BELOW))
+        threshold = current * (1.5 if direction == ABOVE else 0.5) * rng.uniform(0.9, 1.1)
+        alerts.append(Alert(alert_id, alert_id, base, target, direction, threshold, 0.0))
+    indexes = {}
+    for size in (1_000, 10_000, 100_000):
+        indexes[size] = AlertIndex()
+        for alert in alerts[:size]:
+            indexes[size].add(alert)
+
+    def scan(size: int) -> List[Alert]:
+        return [
+            alert
+            for alert in alerts[:size]
+            if (rate_now := matrix[alert.base][alert.target]) is not None
+            and (rate_now >= alert.threshold if alert.direction == ABOVE else rate_now <= alert.threshold)
+        ]
+
+    known = frozenset(codes)
+
+    # A burst of 🔄/back taps from users with different favorites on one snapshot version.
+    snapshot = RateSnapshot(matrix, version=1)
+    taps = itertools.cycle([tuple(rng.sample(codes, 4)) for _ in range(64)])
+
+    def render_cached() -> None:
+        favorites = next(taps)
+        exchange_bot.build_welcome_message(snapshot, favorites)
+        exchange_bot.build_main_menu(favorites)
+
+    def render_uncached() -> None:
+        favorites = next(taps)
+        exchange_bot._TEXT_CACHE.clear()
+        exchange_bot._render_welcome_message(snapshot, favorites, refreshed=False)
+        exchange_bot.build_main_menu.__wrapped__(favorites)
+
+    cases = {
+        "convert_decimal_ns": lambda: str(convert(amount)),
+        "convert_float_ns": lambda: f"{float_amount * rate:.2f}",
+        "cross_matrix_160_ns": lambda: build_cross_matrix(quotes, codes),
+        "alerts_match_1k_ns": lambda: indexes[1_000].match_rates(matrix),
+        "alerts_match_10k_ns": lambda: indexes[10_000].match_rates(matrix),
+        "alerts_match_100k_ns": lambda: indexes[100_000].match_rates(matrix),
+        "alerts_scan_1k_ns": lambda: scan(1_000),
+        "alerts_scan_10k_ns": lambda: scan(10_000),
+        "alerts_scan_100k_ns": lambda: scan(100_000),
+        "inline_parse_ns": lambda: parse_query("5k rub→cny", known),
+        "render_burst_cached_ns": render_cached,
+        "render_burst_uncached_ns": render_uncached,
+    }
+    results = {}
+    for name, case in cases.items():
+        slow = name == "cross_matrix_160_ns" or name.startswith("alerts_scan_")
+        runs = max(1, number // 1000) if slow else number
+        results[name] = timeit.timeit(case, number=runs) / runs * 1e9
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1000, help="number of synthetic users (one flow each)")
+    parser.add_argument("--rate", type=float, default=200.0, help="new users per second; 0 starts all at once")
+    parser.add_argument("--concurrency", type=int, default=64, help="UPDATE_CONCURRENCY of the Application")
+    parser.add_argument("--send-rate", type=float, default=0.0,
+                        help="TELEGRAM_SEND_RATE of the send scheduler; 0 (default) measures the bot without it")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run exchange_bot.py with WORKERS processes against a local Bot API instead")
+    parser.add_argument("--transport", choices=("inprocess", "polling", "webhook", "compare"), default=None,
+                        help="how updates reach the bot: in-process (default without --workers), getUpdates "
+                             "or webhook to a real bot process, or compare runs both of the latter")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per stub rates API call")
+    parser.add_argument("--all-currencies", type=float, default=0.3,
+                        help="share of users picking a base outside the default favorites")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--micro", action="store_true", help="run the micro benchmarks instead of the load test")
+    parser.add_argument("--number", type=int, default=100_000, help="iterations per micro benchmark")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON to PATH")
+    args = parser.parse_args(argv)
+
+    if args.micro:
+        report: Dict[str, Any] = run_micro(args.number)
+        for name, value in report.items():
+            print(f"{name:<24} {value:>12.0f}")
+    else:
+        if args.transport is None:
+            args.transport = "polling" if args.workers else "inprocess"
+        if args.transport == "compare":
+            report = asyncio.run(compare_transports(args))
+            print_transport_comparison(report)
+        elif args.transport == "inprocess":
+            if args.workers:
+                parser.error("--workers needs --transport polling or webhook")
+            report = asyncio.run(run_load(args))
+            print_load_report(report)
+        else:
+            report = asyncio.run(run_processes(args, args.transport))
+            print_load_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
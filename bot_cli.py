@@ -5,8 +5,14 @@ import os
 import subprocess
 import sys
 import textwrap
+import time
+import urllib.request
+from collections import defaultdict
 from pathlib import Path
-from typing import Callable, Dict, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cluster import SharedSnapshot, read_status
+from metrics import Sample, histogram_quantile, parse_exposition
 
 BASE_DIR = Path(__file__).resolve().parent
 SERVICE_NAME = "exchange_bot"
@@ -152,6 +158,244 @@ def update_repo() -> None:
         print(result.stderr.strip())
 
 
+def _env_value(name: str, default: str) -> str:
+    """Read *name* from the environment or, failing that, from the bot's .env file."""
+
+    if name in os.environ:
+        return os.environ[name]
+    env_file = BASE_DIR / ".env"
+    if env_file.exists():
+        for line in env_file.read_text(encoding="utf-8").splitlines():
+            key, sep, value = line.strip().partition("=")
+            if sep and key.strip() == name:
+                return value.strip().strip("\"'")
+    return default
+
+
+def _set_env_value(name: str, value: str) -> None:
+    """Set *name* in the bot's .env file, replacing an existing line."""
+
+    env_file = BASE_DIR / ".env"
+    lines = env_file.read_text(encoding="utf-8").splitlines() if env_file.exists() else []
+    for idx, line in enumerate(lines):
+        key, sep, _ = line.strip().partition("=")
+        if sep and key.strip() == name:
+            lines[idx] = f"{name}={value}"
+            break
+    else:
+        lines.append(f"{name}={value}")
+    env_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _data_path(name: str, default_name: str) -> Path:
+    data_dir = Path(_env_value("DATA_DIR", str(BASE_DIR / "data")))
+    return Path(_env_value(name, str(data_dir / default_name)))
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _metrics_urls() -> List[Tuple[str, str]]:
+    """``(process, URL)`` of every metrics endpoint: the leader, then worker ``i`` on ``METRICS_PORT + 1 + i``."""
+
+    explicit = _env_value("METRICS_URL", "")
+    if explicit:
+        return [("бот", explicit)]
+    host = _env_value("METRICS_LISTEN", "127.0.0.1")
+    if host in {"0.0.0.0", "::", ""}:
+        host = "127.0.0.1"
+    port = int(_env_value("METRICS_PORT", "9464"))
+    workers = _env_value("WORKERS", "0")
+    count = int(workers) if workers.isdigit() else 0
+    urls = [("ведущий процесс" if count else "бот", f"http://{host}:{port}/metrics")]
+    urls.extend((f"воркер {index}", f"http://{host}:{port + 1 + index}/metrics") for index in range(count))
+    return urls
+
+
+# Gauges that describe the rates refresh, which only the leader does; every other
+# series is summed over the processes (alerts and queues are sharded between workers).
+_LEADER_GAUGES = {
+    "exchange_bot_rates_age_seconds",
+    "exchange_bot_rates_stale",
+    "exchange_bot_rates_version",
+    "exchange_bot_rates_refresh_failures",
+    "exchange_bot_rates_circuit_open",
+    "exchange_bot_cluster_workers_connected",
+}
+
+
+def merge_samples(sources: List[List[Sample]]) -> List[Sample]:
+    """Combine the scrapes of several processes; the first one is the leader's."""
+
+    merged: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Sample] = {}
+    for position, samples in enumerate(sources):
+        for name, labels, value in samples:
+            key = (name, tuple(sorted(labels.items())))
+            if key not in merged:
+                if position == 0 or name not in _LEADER_GAUGES:
+                    merged[key] = (name, labels, value)
+            elif name not in _LEADER_GAUGES:
+                merged[key] = (name, labels, merged[key][2] + value)
+    return list(merged.values())
+
+
+def _histograms(samples: List[Sample], name: str, label: str) -> Dict[str, List[Tuple[float, float]]]:
+    buckets: Dict[str, List[Tuple[float, float]]] = defaultdict(list)
+    for sample_name, labels, value in samples:
+        if sample_name == f"{name}_bucket":
+            buckets[labels.get(label, "")].append((float(labels["le"]), value))
+    return buckets
+
+
+def _latency_line(title: str, buckets: List[Tuple[float, float]]) -> str:
+    count = max(value for _, value in buckets)
+    quantiles = [histogram_quantile(q, buckets) for q in (0.5, 0.95, 0.99)]
+    p50, p95, p99 = (f"{value * 1000:.0f}" if value is not None else "—" for value in quantiles)
+    return f"  {title:<24} {count:>8.0f}  p50 {p50:>6} мс  p95 {p95:>6} мс  p99 {p99:>6} мс"
+
+
+def summarize_metrics(samples: List[Sample]) -> List[str]:
+    values: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {
+        (name, tuple(sorted(labels.items()))): value for name, labels, value in samples
+    }
+
+    def single(name: str) -> Optional[float]:
+        return values.get((name, ()))
+
+    lines = ["Обработчики (запросов, задержка):"]
+    errors = {
+        dict(labels)["handler"]: value
+        for (name, labels), value in values.items()
+        if name == "exchange_bot_handler_errors_total"
+    }
+    for handler, buckets in sorted(_histograms(samples, "exchange_bot_handler_duration_seconds", "handler").items()):
+        line = _latency_line(handler, buckets)
+        if errors.get(handler):
+            line += f"  ошибок {errors[handler]:.0f}"
+        lines.append(line)
+
+    lines.append("Источники курсов:")
+    for provider, buckets in sorted(_histograms(samples, "exchange_bot_upstream_duration_seconds", "provider").items()):
+        outcomes = {
+            dict(labels)["outcome"]: value
+            for (name, labels), value in values.items()
+            if name == "exchange_bot_upstream_requests_total" and dict(labels).get("provider") == provider
+        }
+        lines.append(_latency_line(provider, buckets))
+        lines.append("    " + ", ".join(f"{outcome}: {count:.0f}" for outcome, count in sorted(outcomes.items())))
+
+    lookups = {
+        dict(labels)["result"]: value
+        for (name, labels), value in values.items()
+        if name == "exchange_bot_rate_cache_lookups_total"
+    }
+    total = sum(lookups.values())
+    if total:
+        lines.append(
+            f"Кэш курсов: попаданий {lookups.get('hit', 0) / total:.1%}, устаревших {lookups.get('stale', 0) / total:.1%}, "
+            f"промахов {lookups.get('miss', 0) / total:.1%} из {total:.0f}"
+        )
+    age = single("exchange_bot_rates_age_seconds")
+    if age is not None:
+        lines.append(
+            f"Курсы: версия {single('exchange_bot_rates_version') or 0:.0f}, возраст {age:.0f} с"
+            + (" (устарели)" if single("exchange_bot_rates_stale") else "")
+            + f", неудачных обновлений подряд {single('exchange_bot_rates_refresh_failures') or 0:.0f}"
+            + (", обновления на паузе" if single("exchange_bot_rates_circuit_open") else "")
+        )
+    dropped = {
+        dict(labels)["reason"]: value
+        for (name, labels), value in values.items()
+        if name == "exchange_bot_updates_dropped_total"
+    }
+    lines.append(
+        f"Защита от флуда: отклонено частых {dropped.get('throttled', 0):.0f}, повторных {dropped.get('duplicate', 0):.0f}, "
+        f"пропущено одинаковых правок {single('exchange_bot_edits_skipped_total') or 0:.0f}, "
+        f"ответов 429 от Telegram {single('exchange_bot_telegram_flood_waits_total') or 0:.0f}"
+    )
+    lines.append(
+        f"Очереди: обновлений {single('exchange_bot_update_queue_depth') or 0:.0f}, "
+        f"уведомлений {single('exchange_bot_notification_queue_depth') or 0:.0f}; "
+        f"активных уведомлений {single('exchange_bot_alerts_active') or 0:.0f}"
+    )
+    return lines
+
+
+def stats() -> None:
+    sources: List[List[Sample]] = []
+    for process, url in _metrics_urls():
+        print(f"Читаем метрики ({process}) с {url}...")
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:  # noqa: S310
+                sources.append(parse_exposition(response.read().decode("utf-8")))
+        except (OSError, ValueError) as exc:
+            print(f"Не удалось получить метрики ({process}): {exc}")
+            sources.append([])  # keeps the leader's scrape first
+    if not any(sources):
+        print("Метрики недоступны. Бот запущен и METRICS_PORT не равен 0?")
+        return
+    for line in summarize_metrics(merge_samples(sources)):
+        print(line)
+
+
+def cluster() -> None:
+    workers = _env_value("WORKERS", "0")
+    if not workers.isdigit() or int(workers) == 0:
+        print("Многопроцессный режим выключен (WORKERS=0). Включить: CBR-rates workers 4")
+    status = read_status(_data_path("CLUSTER_STATUS_PATH", "cluster.json"))
+    if status is None:
+        print("Нет данных о воркерах: бот ещё не запускался с WORKERS больше 0.")
+        return
+    leader_pid = status.get("leader_pid")
+    print(
+        f"Ведущий процесс: pid {leader_pid}, {'работает' if _pid_alive(leader_pid) else 'не запущен'}; "
+        f"данные обновлены {time.time() - status['updated_at']:.0f} с назад"
+    )
+    for worker in status["workers"]:
+        if worker["connected"]:
+            state = "подключён"
+        elif worker["running"]:
+            state = "запускается"
+        else:
+            state = "остановлен"
+        print(
+            f"  воркер {worker['index']}: pid {worker['pid']}, {state}, обновлений {worker['routed']}, "
+            f"ждут отправки {worker['backlog']}, перезапусков {worker['restarts']}"
+        )
+    try:
+        shared = SharedSnapshot.open(_data_path("SHARED_RATES_PATH", "rates.mmap"))
+    except (OSError, ValueError) as exc:
+        print(f"Общие курсы недоступны: {exc}")
+        return
+    version, fetched_at, source = shared.header()
+    shared.close()
+    if version:
+        print(f"Общие курсы: версия {version}, возраст {time.time() - fetched_at:.0f} с, источник {source or '—'}")
+    else:
+        print("Общие курсы ещё не опубликованы.")
+
+
+def set_workers(count: Optional[str] = None) -> None:
+    current = _env_value("WORKERS", "0")
+    if count is None:
+        count = input(f"Число воркеров (сейчас {current}, 0 — один процесс): ").strip()
+    if not count.isdigit():
+        print("Укажите целое число не меньше 0, например: CBR-rates workers 4")
+        return
+    _set_env_value("WORKERS", count)
+    print(f"WORKERS={count} записано в {BASE_DIR / '.env'}.")
+    restart()
+
+
 def delete() -> None:
     print("Останавливаем сервис и отключаем автозапуск exchange_bot...")
     if _run_command(_systemctl_args("disable", "--now", SERVICE_NAME)):
@@ -161,17 +405,23 @@ def delete() -> None:
         )
 
 
-COMMANDS: Dict[str, Callable[[], None]] = {
+COMMANDS: Dict[str, Callable[..., None]] = {
     "status": status,
     "update": update_repo,
     "restart": restart,
     "reload": reload_bot,
     "logs": show_logs,
+    "stats": stats,
+    "cluster": cluster,
+    "workers": set_workers,
     "stop": stop,
     "start": start,
     "delete": delete,
 }
 
+# Commands that accept an argument on the command line, e.g. ``CBR-rates workers 4``.
+ARGUMENT_COMMANDS = {"workers"}
+
 
 def _print_menu() -> None:
     descriptions = {
@@ -180,6 +430,9 @@ def _print_menu() -> None:
         "restart": "Выполнить systemctl restart exchange_bot",
         "reload": "Выполнить systemctl reload-or-restart exchange_bot",
         "logs": "Показать journalctl -u exchange_bot",
+        "stats": "Сводка метрик: задержки, источники курсов, кэш, очереди",
+        "cluster": "Состояние ведущего процесса, воркеров и общих курсов",
+        "workers": "Задать число воркеров (WORKERS) и перезапустить бота",
         "stop": "Выполнить systemctl stop exchange_bot",
         "start": "Выполнить systemctl start exchange_bot",
         "delete": "Выполнить systemctl disable --now exchange_bot",
@@ -231,7 +484,10 @@ def main(argv: Optional[list[str]] = None) -> None:
         print("Неизвестная команда. Доступные: " + ", ".join(COMMANDS.keys()))
         raise SystemExit(1)
 
-    COMMANDS[command]()
+    if command in ARGUMENT_COMMANDS:
+        COMMANDS[command](*remaining[1:2])
+    else:
+        COMMANDS[command]()
 
 
 if __name__ == "__main__":
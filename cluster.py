@@ -0,0 +1,418 @@
+"""Multi-process mode: one leader refreshes rates and receives updates, N workers handle them.
+
+* ``SharedSnapshot`` is an mmap'd file holding the rate matrix as packed
+  doubles behind a seqlock.  The leader publishes every new snapshot; workers
+  check the version (one 16-byte read) and rebuild their view only when it
+  changed.
+* ``WorkerPool`` runs on the leader: it starts the worker processes, restarts
+  them when they exit and routes every update to ``key % workers`` over a
+  Unix socket, so all updates of one chat land in the same worker.
+* ``LeaderLink`` is the worker's end of that socket.
+
+Messages on the socket are JSON objects, one per line.  Nothing here depends
+on Telegram; ``exchange_bot.py`` wires it to the Application.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from rates import RatesMatrix, RateSnapshot
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"XBRATES1"
+# magic, sequence (odd while a write is in progress), version, fetched_at, currency count, source
+_HEADER = struct.Struct("<8sQQdI64s")
+_SEQUENCE = struct.Struct("<QQ")  # sequence and version, read together
+_SEQUENCE_OFFSET = 8
+
+# Updates kept for a worker that is (re)starting; older ones are dropped first.
+BACKLOG_LIMIT = 10_000
+STATUS_INTERVAL = 5.0
+
+
+def shard_of(key: int, workers: int) -> int:
+    return key % workers
+
+
+def _write_json_atomic(path: Path, payload: Mapping[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def read_status(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class SharedSnapshot:
+    """Rate snapshot shared between processes through an mmap'd file.
+
+    Layout: header, the currency codes (3 ASCII bytes each, padded to 8
+    bytes), then the N×N matrix as doubles with NaN for missing rates and the
+    diagonal.  The single writer bumps the sequence to an odd number, writes,
+    and bumps it again; a reader retries when the sequence was odd or changed
+    while it was reading.
+    """
+
+    def __init__(self, path: Path, mapping: mmap.mmap, currencies: Sequence[str]) -> None:
+        self.path = path
+        self._map = mapping
+        self.currencies = tuple(currencies)
+        count = len(self.currencies)
+        self._matrix_offset = _HEADER.size + -(-3 * count // 8) * 8
+        self._matrix_size = 8 * count * count
+
+    @classmethod
+    def create(cls, path: Path, currencies: Sequence[str]) -> "SharedSnapshot":
+        """Create (or replace) the file for *currencies*; used by the leader."""
+
+        count = len(currencies)
+        size = _HEADER.size + -(-3 * count // 8) * 8 + 8 * count * count
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with tmp_path.open("wb") as handle:
+            handle.write(_HEADER.pack(_MAGIC, 0, 0, 0.0, count, b""))
+            handle.write("".join(currencies).encode("ascii").ljust(size - _HEADER.size - 8 * count * count, b"\0"))
+            handle.truncate(size)
+        os.replace(tmp_path, path)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path: Path) -> "SharedSnapshot":
+        with path.open("r+b") as handle:
+            mapping = mmap.mmap(handle.fileno(), 0)
+        magic, _, _, _, count, _ = _HEADER.unpack_from(mapping, 0)
+        if magic != _MAGIC:
+            mapping.close()
+            raise ValueError(f"{path} не является файлом общих курсов")
+        codes = mapping[_HEADER.size:_HEADER.size + 3 * count].decode("ascii")
+        return cls(path, mapping, [codes[i:i + 3] for i in range(0, len(codes), 3)])
+
+    def close(self) -> None:
+        self._map.close()
+
+    def version(self) -> int:
+        """Version of the published snapshot (0 before the first publish)."""
+
+        sequence, version = _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)
+        return 0 if sequence & 1 else version
+
+    def publish(self, snapshot: RateSnapshot) -> None:
+        nan = math.nan
+        values = array("d")
+        for base in self.currencies:
+            row = snapshot.rates.get(base, {})
+            for target in self.currencies:
+                value = row.get(target) if target != base else None
+                values.append(nan if value is None else value)
+
+        sequence = _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0] | 1
+        struct.pack_into("<Q", self._map, _SEQUENCE_OFFSET, sequence)
+        self._map[self._matrix_offset:self._matrix_offset + self._matrix_size] = values.tobytes()
+        _HEADER.pack_into(
+            self._map, 0, _MAGIC, sequence, snapshot.version, snapshot.fetched_at, len(self.currencies),
+            snapshot.source.encode("utf-8")[:64],
+        )
+        struct.pack_into("<Q", self._map, _SEQUENCE_OFFSET, sequence + 1)
+
+    def read(self) -> Optional[RateSnapshot]:
+        """Return a consistent copy of the published snapshot, or ``None`` before the first publish."""
+
+        codes = self.currencies
+        count = len(codes)
+        while True:
+            _, sequence, version, fetched_at, _, source = _HEADER.unpack_from(self._map, 0)
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            if version == 0:
+                return None
+            end = self._matrix_offset + self._matrix_size
+            with memoryview(self._map) as view, view[self._matrix_offset:end] as region, region.cast("d") as values:
+                flat = values.tolist()
+            rates: RatesMatrix = {}
+            for i, base in enumerate(codes):
+                rates[base] = {
+                    target: (None if value != value else value)  # NaN marks a missing rate
+                    for target, value in zip(codes, flat[i * count:(i + 1) * count])
+                    if target != base
+                }
+            if _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0] == sequence:
+                return RateSnapshot(
+                    rates=rates, version=version, fetched_at=fetched_at, source=source.rstrip(b"\0").decode("utf-8")
+                )
+
+    def header(self) -> Tuple[int, float, str]:
+        """Version, fetch time and source of the published snapshot."""
+
+        _, _, version, fetched_at, _, source = _HEADER.unpack_from(self._map, 0)
+        return version, fetched_at, source.rstrip(b"\0").decode("utf-8")
+
+
+MessageCallback = Callable[[int, Dict[str, Any]], Awaitable[None]]
+
+
+class _Worker:
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.backlog: Deque[bytes] = deque(maxlen=BACKLOG_LIMIT)
+        self.restarts = 0
+        self.routed = 0
+        self.started_at: Optional[float] = None
+
+
+class WorkerPool:
+    """Leader side of the cluster: worker processes, their sockets and routing.
+
+    Worker *i* is started as ``command`` with ``CLUSTER_WORKER_INDEX=i`` added
+    to *env*, connects to *socket_path* and says ``{"worker": i}``.  Updates
+    for a worker that is not connected yet wait in a bounded backlog.
+    Messages from workers are passed to *on_message* with the worker index.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        socket_path: Path,
+        command: Sequence[str],
+        env: Mapping[str, str],
+        on_message: MessageCallback,
+        *,
+        status_path: Optional[Path] = None,
+    ) -> None:
+        self.socket_path = socket_path
+        self.command = list(command)
+        self.env = dict(env)
+        self.on_message = on_message
+        self.status_path = status_path
+        self.workers = [_Worker(index) for index in range(workers)]
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self.started_at = time.time()
+
+    async def start(self) -> None:
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self.socket_path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(self._serve, path=str(self.socket_path))
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._supervise(worker)) for worker in self.workers]
+        if self.status_path is not None:
+            self._tasks.append(loop.create_task(self._write_status_periodically()))
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        self._stopping = True
+        if self._server is not None:
+            self._server.close()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.terminate()
+        processes = [worker.process.wait() for worker in self.workers if worker.process is not None]
+        try:
+            await asyncio.wait_for(asyncio.gather(*processes), timeout)
+        except asyncio.TimeoutError:
+            for worker in self.workers:
+                if worker.process is not None and worker.process.returncode is None:
+                    logger.warning("Воркер %d не завершился за %.0f с, останавливаем принудительно", worker.index, timeout)
+                    worker.process.kill()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        self.socket_path.unlink(missing_ok=True)
+        self._write_status()
+
+    async def route(self, key: int, message: Dict[str, Any]) -> None:
+        await self.send(shard_of(key, len(self.workers)), message)
+
+    async def send(self, index: int, message: Dict[str, Any]) -> None:
+        worker = self.workers[index]
+        line = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        worker.routed += 1
+        writer = worker.writer
+        if writer is None or writer.is_closing():
+            worker.backlog.append(line)
+            return
+        writer.write(line)
+        # Waiting here slows the leader down to the pace of its slowest worker
+        # instead of buffering without bound.
+        await writer.drain()
+
+    def connected(self) -> int:
+        return sum(worker.writer is not None and not worker.writer.is_closing() for worker in self.workers)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "leader_pid": os.getpid(),
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "workers": [
+                {
+                    "index": worker.index,
+                    "pid": worker.process.pid if worker.process is not None else None,
+                    "running": worker.process is not None and worker.process.returncode is None,
+                    "connected": worker.writer is not None and not worker.writer.is_closing(),
+                    "started_at": worker.started_at,
+                    "restarts": worker.restarts,
+                    "routed": worker.routed,
+                    "backlog": len(worker.backlog),
+                }
+                for worker in self.workers
+            ],
+        }
+
+    def _write_status(self) -> None:
+        if self.status_path is None:
+            return
+        try:
+            _write_json_atomic(self.status_path, self.status())
+        except OSError as exc:
+            logger.warning("Не удалось записать состояние кластера в %s: %s", self.status_path, exc)
+
+    async def _write_status_periodically(self) -> None:
+        while True:
+            self._write_status()
+            await asyncio.sleep(STATUS_INTERVAL)
+
+    async def _supervise(self, worker: _Worker) -> None:
+        delay = 0.5
+        while not self._stopping:
+            env = {**self.env, "CLUSTER_WORKER_INDEX": str(worker.index)}
+            worker.process = await asyncio.create_subprocess_exec(*self.command, env=env)
+            worker.started_at = time.time()
+            logger.info("Запущен воркер %d (pid %d)", worker.index, worker.process.pid, extra={"worker": worker.index})
+            self._write_status()
+            returncode = await worker.process.wait()
+            if self._stopping:
+                break
+            worker.restarts += 1
+            # A worker that ran for a while is restarted at once; a crash loop backs off.
+            delay = 1.0 if time.time() - worker.started_at > 60 else min(delay * 2, 60.0)
+            logger.error(
+                "Воркер %d завершился с кодом %s, перезапуск через %.0f с",
+                worker.index,
+                returncode,
+                delay,
+                extra={"worker": worker.index},
+            )
+            self._write_status()
+            await asyncio.sleep(delay)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            hello = json.loads(await reader.readline() or b"{}")
+            index = hello.get("worker")
+            if not isinstance(index, int) or not 0 <= index < len(self.workers):
+                writer.close()
+                return
+            worker = self.workers[index]
+            if worker.writer is not None:
+                worker.writer.close()
+            while worker.backlog:
+                writer.write(worker.backlog.popleft())
+            worker.writer = writer
+            await writer.drain()
+            self._write_status()
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                await self.on_message(index, message)
+        except (ConnectionError, ValueError) as exc:
+            logger.warning("Соединение с воркером прервано: %s", exc)
+        finally:
+            writer.close()
+
+
+class LeaderLink:
+    """Worker side of the cluster socket.
+
+    ``call`` sends a request carrying an ``id`` and waits for the leader's
+    message with the matching ``reply_to``; everything else the leader sends
+    is yielded by ``messages``.
+    """
+
+    def __init__(self, socket_path: Path, index: int) -> None:
+        self.socket_path = socket_path
+        self.index = index
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._calls = itertools.count(1)
+        self._pending: Dict[int, "asyncio.Future[Dict[str, Any]]"] = {}
+
+    async def connect(self, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(
+                    str(self.socket_path), limit=2**22
+                )
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+        await self.send({"worker": self.index})
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        if self._writer is None:
+            raise ConnectionError("Нет соединения с ведущим процессом")
+        self._writer.write(json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n")
+        await self._writer.drain()
+
+    async def call(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        call_id = next(self._calls)
+        future: "asyncio.Future[Dict[str, Any]]" = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        try:
+            await self.send({**message, "id": call_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(call_id, None)
+
+    async def messages(self) -> AsyncIterator[Dict[str, Any]]:
+        """Messages from the leader until it closes the connection."""
+
+        assert self._reader is not None
+        async for line in self._reader:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning("Пропущено повреждённое сообщение от ведущего процесса")
+                continue
+            future = self._pending.get(message.get("reply_to"))
+            if future is None:
+                yield message
+            elif not future.done():
+                future.set_result(message)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
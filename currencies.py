@@ -0,0 +1,80 @@
+"""Currency catalogue, pagination and search used by the bot's keyboards."""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+# Every code returned in exchangerate-api's ``conversion_rates`` (ISO 4217 plus
+# a few territory currencies pegged 1:1, e.g. FOK, GGP, IMP).
+SUPPORTED_CURRENCIES: Tuple[str, ...] = (
+    "AED", "AFN", "ALL", "AMD", "ANG", "AOA", "ARS", "AUD", "AWG", "AZN", "BAM", "BBD", "BDT", "BGN",
+    "BHD", "BIF", "BMD", "BND", "BOB", "BRL", "BSD", "BTN", "BWP", "BYN", "BZD", "CAD", "CDF", "CHF",
+    "CLP", "CNY", "COP", "CRC", "CUP", "CVE", "CZK", "DJF", "DKK", "DOP", "DZD", "EGP", "ERN", "ETB",
+    "EUR", "FJD", "FKP", "FOK", "GBP", "GEL", "GGP", "GHS", "GIP", "GMD", "GNF", "GTQ", "GYD", "HKD",
+    "HNL", "HRK", "HTG", "HUF", "IDR", "ILS", "IMP", "INR", "IQD", "IRR", "ISK", "JEP", "JMD", "JOD",
+    "JPY", "KES", "KGS", "KHR", "KID", "KMF", "KRW", "KWD", "KYD", "KZT", "LAK", "LBP", "LKR", "LRD",
+    "LSL", "LYD", "MAD", "MDL", "MGA", "MKD", "MMK", "MNT", "MOP", "MRU", "MUR", "MVR", "MWK", "MXN",
+    "MYR", "MZN", "NAD", "NGN", "NIO", "NOK", "NPR", "NZD", "OMR", "PAB", "PEN", "PGK", "PHP", "PKR",
+    "PLN", "PYG", "QAR", "RON", "RSD", "RUB", "RWF", "SAR", "SBD", "SCR", "SDG", "SEK", "SGD", "SHP",
+    "SLE", "SLL", "SOS", "SRD", "SSP", "STN", "SYP", "SZL", "THB", "TJS", "TMT", "TND", "TOP", "TRY",
+    "TTD", "TVD", "TWD", "TZS", "UAH", "UGX", "USD", "UYU", "UZS", "VES", "VND", "VUV", "WST", "XAF",
+    "XCD", "XDR", "XOF", "XPF", "YER", "ZAR", "ZMW", "ZWL",
+)
+
+FLAGS: Dict[str, str] = {
+    "RUB": "🇷🇺",
+    "USD": "🇺🇸",
+    "EUR": "🇪🇺",
+    "CNY": "🇨🇳",
+    "GBP": "🇬🇧",
+    "JPY": "🇯🇵",
+    "CHF": "🇨🇭",
+    "TRY": "🇹🇷",
+    "KZT": "🇰🇿",
+    "BYN": "🇧🇾",
+    "UAH": "🇺🇦",
+    "AED": "🇦🇪",
+}
+
+
+def label(code: str) -> str:
+    flag = FLAGS.get(code)
+    return f"{flag} {code}" if flag else code
+
+
+def page_count(total: int, page_size: int) -> int:
+    return max(1, -(-total // page_size))
+
+
+def page_slice(items: Sequence[str], page: int, page_size: int) -> Tuple[Sequence[str], int]:
+    """Return the items of *page* (clamped to the valid range) and the page actually shown."""
+
+    page = min(max(page, 0), page_count(len(items), page_size) - 1)
+    start = page * page_size
+    return items[start:start + page_size], page
+
+
+class CurrencySearch:
+    """Prefix search over currency codes and the word aliases of the inline parser.
+
+    Every prefix of every code and alias is indexed once, so a lookup is a
+    single dict access no matter how many currencies are configured.
+    """
+
+    def __init__(self, currencies: Iterable[str], aliases: Mapping[str, str]) -> None:
+        self.currencies = tuple(currencies)
+        known = set(self.currencies)
+        self._index: Dict[str, List[str]] = {}
+        for code in self.currencies:
+            self._add(code.lower(), code)
+        for word, code in aliases.items():
+            if code in known and word.isalpha():
+                self._add(word.lower(), code)
+
+    def _add(self, word: str, code: str) -> None:
+        for end in range(1, len(word) + 1):
+            matches = self._index.setdefault(word[:end], [])
+            if code not in matches:
+                matches.append(code)
+
+    def find(self, text: str, limit: int) -> List[str]:
+        return self._index.get(text.strip().lower(), [])[:limit]
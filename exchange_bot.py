@@ -1,65 +1,302 @@
+import asyncio
+import io
+import logging
 import os
-from typing import Dict
+import re
+import signal
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
-import requests
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Update,
+)
 from telegram.ext import (
     Application,
+    ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.request import BaseRequest
+
+from alerts import AlertIndex, AlertStore, NotificationSender, group_by_chat
+from batch import (
+    BatchTotals,
+    convert_amounts,
+    format_batch_table,
+    format_totals,
+    iter_csv_amounts,
+    parse_amounts,
+    write_batch_csv,
+)
+from cluster import LeaderLink, SharedSnapshot, WorkerPool
+from currencies import SUPPORTED_CURRENCIES, CurrencySearch, label, page_count, page_slice
+from flood_control import FloodControl, SendScheduler, edit_markup_if_changed, edit_text_if_changed
+from logging_setup import setup_logging
+from metrics import (
+    ACTIVE_ALERTS,
+    CIRCUIT_OPEN,
+    CLUSTER_WORKERS_CONNECTED,
+    NOTIFICATION_QUEUE_DEPTH,
+    RATES_AGE,
+    RATES_STALE,
+    RATES_VERSION,
+    REFRESH_FAILURES,
+    REGISTRY,
+    UPDATE_QUEUE_DEPTH,
+    timed_handler,
+)
+from money import conversion_table, format_money
+from providers import CbrDailyProvider, ExchangeRateApiProvider, ProviderPool, RateProvider
+from query_parser import SYMBOL_ALIASES, parse_query, query_targets
+from rate_fetcher import RateFetcher
+from rate_history import RateHistory
+from rates import (
+    RateCache,
+    RateSnapshot,
+    RefreshPolicy,
+    build_cross_matrix,
+    check_drift,
+    load_snapshot,
+    save_snapshot,
+)
+from user_state import UserStatePersistence
+from webhook_server import WebhookServer
 
 load_dotenv()
 
+logger = logging.getLogger("exchange_bot")
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 API_KEY = os.getenv("API_KEY")
 
 if not BOT_TOKEN or not API_KEY:
     raise ValueError("Не удалось загрузить BOT_TOKEN или API_KEY. Проверьте файл .env.")
 
-BASE_URLS = {
-    "RUB": f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/RUB",
-    "USD": f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/USD",
-    "EUR": f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/EUR",
-    "CNY": f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/CNY",
-}
+RATES_REFERENCE = os.getenv("RATES_REFERENCE", "USD")
+RATE_PROVIDERS = [name.strip() for name in os.getenv("RATE_PROVIDERS", "exchangerate-api,cbr").split(",") if name.strip()]
+RATES_QUORUM = int(os.getenv("RATES_QUORUM", "1"))
+RATES_HEDGE_DELAY = float(os.getenv("RATES_HEDGE_DELAY", "3"))
+# Bot API base URL including the "/bot" prefix, e.g. a local Bot API server; Telegram's when empty.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+EXCHANGERATE_API_URL = os.getenv("EXCHANGERATE_API_URL", "https://v6.exchangerate-api.com/v6")
+CBR_URL = os.getenv("CBR_URL", "https://www.cbr.ru/scripts/XML_daily.asp")
+
+
+def _currency_list(value: str) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(code.strip().upper() for code in value.split(",") if code.strip()))
+
+
+CURRENCIES = _currency_list(os.getenv("CURRENCIES", ",".join(SUPPORTED_CURRENCIES)))
+CURRENCY_SET = frozenset(CURRENCIES)
+DEFAULT_FAVORITES = tuple(
+    code for code in _currency_list(os.getenv("FAVORITE_CURRENCIES", "RUB,USD,EUR,CNY")) if code in CURRENCY_SET
+)
+FAVORITES_LIMIT = int(os.getenv("FAVORITES_LIMIT", "6"))
+CURRENCY_PAGE_SIZE = 20
+CURRENCY_COLUMNS = 4
+CURRENCY_SEARCH = CurrencySearch(CURRENCIES, SYMBOL_ALIASES)
+
+DATA_DIR = Path(os.getenv("DATA_DIR", Path(__file__).resolve().parent / "data"))
+RATES_SNAPSHOT_PATH = Path(os.getenv("RATES_SNAPSHOT_PATH", DATA_DIR / "rates_snapshot.json"))
+HISTORY_DB_PATH = Path(os.getenv("HISTORY_DB_PATH", DATA_DIR / "history.sqlite3"))
+HISTORY_RAW_DAYS = float(os.getenv("HISTORY_RAW_DAYS", "7"))
+HISTORY_HOURLY_DAYS = float(os.getenv("HISTORY_HOURLY_DAYS", "180"))
+HISTORY_CURRENCIES = tuple(
+    code
+    for code in _currency_list(os.getenv("HISTORY_CURRENCIES", ",".join(DEFAULT_FAVORITES)))
+    if code in CURRENCY_SET
+)
+
+USER_STATE_DB_PATH = Path(os.getenv("USER_STATE_DB_PATH", DATA_DIR / "user_state.sqlite3"))
+USER_STATE_FLUSH_INTERVAL = float(os.getenv("USER_STATE_FLUSH_INTERVAL", "30"))
+USER_STATE_CACHE_SIZE = int(os.getenv("USER_STATE_CACHE_SIZE", "10000"))
+USER_STATE_IDLE_TTL = float(os.getenv("USER_STATE_IDLE_TTL", "3600"))
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "1"))
+
+FLOOD_USER_RATE = float(os.getenv("FLOOD_USER_RATE", "1"))
+FLOOD_USER_BURST = float(os.getenv("FLOOD_USER_BURST", "5"))
+FLOOD_COALESCE_WINDOW = float(os.getenv("FLOOD_COALESCE_WINDOW", "1"))
+TELEGRAM_SEND_RATE = float(os.getenv("TELEGRAM_SEND_RATE", "30"))
+TELEGRAM_GROUP_SEND_RATE = float(os.getenv("TELEGRAM_GROUP_SEND_RATE", "20"))
+
+WORKERS = int(os.getenv("WORKERS", "0"))
+CLUSTER_SOCKET_PATH = Path(os.getenv("CLUSTER_SOCKET_PATH", DATA_DIR / "cluster.sock"))
+CLUSTER_STATUS_PATH = Path(os.getenv("CLUSTER_STATUS_PATH", DATA_DIR / "cluster.json"))
+SHARED_RATES_PATH = Path(os.getenv("SHARED_RATES_PATH", DATA_DIR / "rates.mmap"))
+SHARED_RATES_POLL_INTERVAL = 1.0
+# Set by the leader for every worker process it starts; unset in the leader and in single-process mode.
+CLUSTER_WORKER_INDEX = int(os.environ["CLUSTER_WORKER_INDEX"]) if "CLUSTER_WORKER_INDEX" in os.environ else None
 
-CURRENCIES = ("RUB", "USD", "EUR", "CNY")
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+BATCH_TABLE_LIMIT = int(os.getenv("BATCH_TABLE_LIMIT", "50"))
+BATCH_MAX_FILE_SIZE = 20 * 1024 * 1024  # Bot API download limit
+
+HISTORY_PERIOD_UNITS = {"h": 3600, "d": 86400, "w": 7 * 86400, "m": 30 * 86400, "y": 365 * 86400}
+HISTORY_PERIOD_RE = re.compile(r"^(\d{1,4})([hdwmy])$")
+HISTORY_MAX_PERIOD = 10 * HISTORY_PERIOD_UNITS["y"]
+HISTORY_DEFAULT_PERIOD = "30d"
+
+ALERTS_DB_PATH = Path(os.getenv("ALERTS_DB_PATH", DATA_DIR / "alerts.sqlite3"))
+ALERTS_PER_CHAT = int(os.getenv("ALERTS_PER_CHAT", "20"))
+ALERTS_SEND_RATE = float(os.getenv("ALERTS_SEND_RATE", "25"))
+ALERT_RE = re.compile(r"^([A-Z]{3})\s+([A-Z]{3})\s*([<>])\s*(\d+(?:[.,]\d+)?)$")
+
+RATES_TTL = float(os.getenv("RATES_TTL", "300"))
+RATES_STALE_TTL = float(os.getenv("RATES_STALE_TTL", "3600"))
+RATES_MIN_REFRESH_INTERVAL = float(os.getenv("RATES_MIN_REFRESH_INTERVAL", "30"))
+RATES_REFRESH_INTERVAL = float(os.getenv("RATES_REFRESH_INTERVAL", "60"))
+RATES_REFRESH_JITTER = float(os.getenv("RATES_REFRESH_JITTER", "5"))
+RATES_MAX_BACKOFF = float(os.getenv("RATES_MAX_BACKOFF", "900"))
+RATES_FAILURE_THRESHOLD = int(os.getenv("RATES_FAILURE_THRESHOLD", "3"))
+RATES_CIRCUIT_COOLDOWN = float(os.getenv("RATES_CIRCUIT_COOLDOWN", "300"))
+RATES_MAX_DRIFT = float(os.getenv("RATES_MAX_DRIFT", "0.1"))
+UPSTREAM_REQUEST_TIMEOUT = float(os.getenv("UPSTREAM_REQUEST_TIMEOUT", "5"))
+UPSTREAM_TOTAL_TIMEOUT = float(os.getenv("UPSTREAM_TOTAL_TIMEOUT", "10"))
+
+RATE_FETCHER = RateFetcher(request_timeout=UPSTREAM_REQUEST_TIMEOUT)
+
+
+def build_providers(names: List[str]) -> List[RateProvider]:
+    factories = {
+        "exchangerate-api": lambda: ExchangeRateApiProvider(
+            API_KEY, reference=RATES_REFERENCE, base_url=EXCHANGERATE_API_URL
+        ),
+        "cbr": lambda: CbrDailyProvider(url=CBR_URL),
+    }
+    providers: List[RateProvider] = []
+    for name in names:
+        if name not in factories:
+            raise ValueError(f"Неизвестный источник курсов: {name}. Доступные: {', '.join(factories)}.")
+        providers.append(factories[name]())
+    return providers
+
+
+PROVIDER_POOL = ProviderPool(
+    build_providers(RATE_PROVIDERS),
+    quorum=RATES_QUORUM,
+    max_hedge_delay=RATES_HEDGE_DELAY,
+    currencies=CURRENCIES,
+)
 
 
 def _format_rate(rate: float) -> str:
     return f"{rate:.4f}" if isinstance(rate, (int, float)) else "недоступно"
 
 
-def build_main_menu() -> InlineKeyboardMarkup:
-    keyboard = [
+def _grid(buttons: List[InlineKeyboardButton], columns: int) -> List[List[InlineKeyboardButton]]:
+    return [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
+
+
+def _page_navigation(prefix: str, page: int, pages: int) -> List[InlineKeyboardButton]:
+    if pages <= 1:
+        return []
+    return [
+        InlineKeyboardButton("◀️", callback_data=f"{prefix}:{(page - 1) % pages}"),
+        InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="noop"),
+        InlineKeyboardButton("▶️", callback_data=f"{prefix}:{(page + 1) % pages}"),
+    ]
+
+
+@lru_cache(maxsize=1024)
+def build_main_menu(favorites: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    buttons = [InlineKeyboardButton(label(code), callback_data=f"base:{code}") for code in favorites]
+    keyboard = _grid(buttons, 2)
+    keyboard.append(
         [
-            InlineKeyboardButton("🇷🇺 RUB", callback_data="base:RUB"),
-            InlineKeyboardButton("🇺🇸 USD", callback_data="base:USD"),
-        ],
+            InlineKeyboardButton("🌐 Все валюты", callback_data="page:base:0"),
+            InlineKeyboardButton("🔍 Поиск", callback_data="search:base"),
+        ]
+    )
+    keyboard.append([InlineKeyboardButton("🔄 Обновить курсы", callback_data="refresh_rates")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@lru_cache(maxsize=64)
+def build_base_page(page: int) -> InlineKeyboardMarkup:
+    codes, page = page_slice(CURRENCIES, page, CURRENCY_PAGE_SIZE)
+    buttons = [InlineKeyboardButton(label(code), callback_data=f"base:{code}") for code in codes]
+    keyboard = _grid(buttons, CURRENCY_COLUMNS)
+    navigation = _page_navigation("page:base", page, page_count(len(CURRENCIES), CURRENCY_PAGE_SIZE))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:main")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@lru_cache(maxsize=4096)
+def build_target_menu(base: str, favorites: Tuple[str, ...], page: int = 0) -> InlineKeyboardMarkup:
+    """Favorites first, then one page of every other currency, plus search and the ⭐ toggle."""
+
+    targets = tuple(code for code in CURRENCIES if code != base)
+    codes, page = page_slice(targets, page, CURRENCY_PAGE_SIZE)
+    keyboard = _grid(
         [
-            InlineKeyboardButton("🇪🇺 EUR", callback_data="base:EUR"),
-            InlineKeyboardButton("🇨🇳 CNY", callback_data="base:CNY"),
+            InlineKeyboardButton(label(code), callback_data=f"target:{base}:{code}")
+            for code in favorites
+            if code != base
         ],
-        [InlineKeyboardButton("🔄 Обновить курсы", callback_data="refresh_rates")],
-    ]
+        CURRENCY_COLUMNS,
+    )
+    keyboard.extend(
+        _grid(
+            [InlineKeyboardButton(code, callback_data=f"target:{base}:{code}") for code in codes],
+            CURRENCY_COLUMNS,
+        )
+    )
+    navigation = _page_navigation(f"page:target:{base}", page, page_count(len(targets), CURRENCY_PAGE_SIZE))
+    if navigation:
+        keyboard.append(navigation)
+    star = f"☆ Убрать {base} из избранного" if base in favorites else f"⭐ Добавить {base} в избранное"
+    keyboard.append(
+        [
+            InlineKeyboardButton("🔍 Поиск", callback_data=f"search:target:{base}"),
+            InlineKeyboardButton(star, callback_data=f"fav:{base}"),
+        ]
+    )
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:main")])
     return InlineKeyboardMarkup(keyboard)
 
 
-def build_target_menu(base: str) -> InlineKeyboardMarkup:
-    buttons = []
-    for target in CURRENCIES:
-        if target == base:
-            continue
-        buttons.append([InlineKeyboardButton(target, callback_data=f"target:{base}:{target}")])
-    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:main")])
-    return InlineKeyboardMarkup(buttons)
+def build_search_results(matches: List[str], base: Optional[str]) -> InlineKeyboardMarkup:
+    if base is None:
+        buttons = [InlineKeyboardButton(label(code), callback_data=f"base:{code}") for code in matches]
+    else:
+        buttons = [
+            InlineKeyboardButton(label(code), callback_data=f"target:{base}:{code}")
+            for code in matches
+            if code != base
+        ]
+    keyboard = _grid(buttons, CURRENCY_COLUMNS)
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"base:{base}" if base else "back:main")])
+    return InlineKeyboardMarkup(keyboard)
 
 
+@lru_cache(maxsize=None)
 def build_amount_keyboard(base: str, target: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -69,6 +306,7 @@ def build_amount_keyboard(base: str, target: str) -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def build_result_keyboard(base: str, target: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -79,11 +317,13 @@ def build_result_keyboard(base: str, target: str) -> InlineKeyboardMarkup:
     )
 
 
-def format_rates_summary(rates: Dict[str, Dict[str, float]]) -> str:
+def format_rates_summary(rates: Dict[str, Dict[str, float]], favorites: Tuple[str, ...]) -> str:
+    if len(favorites) < 2:
+        return "Добавьте валюты в избранное (⭐), чтобы видеть здесь их курсы."
     lines = []
-    for base in CURRENCIES:
+    for base in favorites:
         conversions = []
-        for target in CURRENCIES:
+        for target in favorites:
             if target == base:
                 continue
             rate = rates.get(base, {}).get(target)
@@ -93,32 +333,199 @@ def format_rates_summary(rates: Dict[str, Dict[str, float]]) -> str:
     return "\n".join(lines)
 
 
-async def fetch_exchange_rates() -> Dict[str, Dict[str, float]]:
-    rates: Dict[str, Dict[str, float]] = {}
-    for base, url in BASE_URLS.items():
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            conversions = {}
-            for target in CURRENCIES:
-                if target == base:
-                    continue
-                conversions[target] = data["conversion_rates"].get(target)
-            rates[base] = conversions
-        except Exception as exc:  # noqa: BLE001
-            print(f"Ошибка при получении курсов валют для {base}: {exc}")
-            rates[base] = {target: None for target in CURRENCIES if target != base}
-    return rates
-
-
-async def ensure_rates(context: ContextTypes.DEFAULT_TYPE, force_refresh: bool = False) -> Dict[str, Dict[str, float]]:
-    if force_refresh or "rates" not in context.user_data:
-        context.user_data["rates"] = await fetch_exchange_rates()
-    return context.user_data["rates"]
-
-
-def build_welcome_message(rates: Dict[str, Dict[str, float]], *, refreshed: bool = False) -> str:
+def user_favorites(context: ContextTypes.DEFAULT_TYPE) -> Tuple[str, ...]:
+    favorites = context.user_data.get("favorites") if context.user_data is not None else None
+    return DEFAULT_FAVORITES if favorites is None else tuple(favorites)
+
+
+async def fetch_exchange_rates() -> Tuple[Dict[str, Dict[str, float]], str]:
+    result = await asyncio.wait_for(PROVIDER_POOL.fetch(RATE_FETCHER), UPSTREAM_TOTAL_TIMEOUT)
+    previous = RATE_CACHE.snapshot
+    for issue in check_drift(
+        previous.rates if previous else None, result.quotes, result.reference, tolerance=RATES_MAX_DRIFT
+    ):
+        logger.warning("Курс изменился сильнее ожидаемого: %s", issue, extra={"provider": result.provider})
+    # The N×N matrix takes milliseconds for ~160 currencies; keep it off the event loop.
+    rates = await asyncio.to_thread(build_cross_matrix, result.quotes, CURRENCIES)
+    return rates, result.provider
+
+
+RATE_HISTORY = RateHistory(
+    HISTORY_DB_PATH,
+    raw_retention=HISTORY_RAW_DAYS * 86400,
+    hourly_retention=HISTORY_HOURLY_DAYS * 86400,
+    currencies=HISTORY_CURRENCIES,
+)
+
+ALERT_STORE = AlertStore(ALERTS_DB_PATH)
+ALERT_INDEX = AlertIndex()
+
+RATE_CACHE = RateCache(
+    fetch_exchange_rates,
+    ttl=RATES_TTL,
+    stale_ttl=RATES_STALE_TTL,
+    min_refresh_interval=RATES_MIN_REFRESH_INTERVAL,
+    failure_threshold=RATES_FAILURE_THRESHOLD,
+    circuit_cooldown=RATES_CIRCUIT_COOLDOWN,
+)
+REFRESH_POLICY = RefreshPolicy(
+    interval=RATES_REFRESH_INTERVAL,
+    jitter=RATES_REFRESH_JITTER,
+    max_backoff=RATES_MAX_BACKOFF,
+)
+
+
+def _per_process(rate: float) -> float:
+    """Split a bot-wide send rate between the worker processes."""
+
+    return rate / WORKERS if CLUSTER_WORKER_INDEX is not None and WORKERS > 0 else rate
+
+
+# The worker's connection to the leader; rates are refreshed by the leader only.
+LEADER_LINK = LeaderLink(CLUSTER_SOCKET_PATH, CLUSTER_WORKER_INDEX) if CLUSTER_WORKER_INDEX is not None else None
+
+
+async def ensure_rates(application: Application, force_refresh: bool = False) -> Optional[RateSnapshot]:
+    if LEADER_LINK is not None:
+        if force_refresh:
+            # The leader has published the new snapshot by the time it replies.
+            await request_leader_refresh()
+            return await sync_shared_rates(application)
+        return RATE_CACHE.snapshot
+    if force_refresh:
+        return await RATE_CACHE.refresh(force=True)
+    return await RATE_CACHE.get()
+
+
+def current_rates() -> Optional[RateSnapshot]:
+    return RATE_CACHE.snapshot
+
+
+async def persist_snapshot(snapshot: RateSnapshot) -> None:
+    await asyncio.to_thread(save_snapshot, RATES_SNAPSHOT_PATH, snapshot)
+
+
+async def record_history(snapshot: RateSnapshot) -> None:
+    await asyncio.to_thread(RATE_HISTORY.record, snapshot)
+
+
+def restore_rates() -> None:
+    snapshot = load_snapshot(RATES_SNAPSHOT_PATH)
+    if snapshot is None:
+        return
+    RATE_CACHE.restore(snapshot)
+    logger.info(
+        "Загружены сохранённые курсы версии %d (%s, возраст %.0f с).",
+        snapshot.version,
+        snapshot.source or "неизвестный источник",
+        snapshot.age(),
+    )
+
+
+async def refresh_rates_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    failures = RATE_CACHE.consecutive_failures
+    try:
+        await RATE_CACHE.refresh()
+        failures = RATE_CACHE.consecutive_failures
+    except Exception as exc:  # noqa: BLE001
+        failures += 1
+        logger.exception("Ошибка фонового обновления курсов: %s", exc)
+    finally:
+        # Rescheduled whatever happened, so one unexpected error cannot end background refreshes.
+        context.job_queue.run_once(refresh_rates_job, REFRESH_POLICY.next_delay(failures), name="refresh_rates")
+
+
+async def publish_shared_rates(shared: SharedSnapshot, snapshot: RateSnapshot) -> None:
+    shared.publish(snapshot)
+
+
+async def sync_shared_rates(application: Application) -> Optional[RateSnapshot]:
+    """Adopt the leader's snapshot if it changed and check this worker's alerts against it."""
+
+    shared: SharedSnapshot = application.bot_data["shared_rates"]
+    local = RATE_CACHE.snapshot
+    version = shared.version()
+    if version == 0 or (local is not None and local.version == version):
+        return local
+    snapshot = shared.read()
+    if snapshot is None:
+        return local
+    RATE_CACHE.restore(snapshot)
+    await check_alerts(application, snapshot)
+    return snapshot
+
+
+async def sync_shared_rates_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await sync_shared_rates(context.application)
+
+
+async def request_leader_refresh() -> None:
+    try:
+        await LEADER_LINK.call({"refresh": True}, UPSTREAM_TOTAL_TIMEOUT + 1)
+    except (asyncio.TimeoutError, ConnectionError) as exc:
+        logger.warning("Ведущий процесс не ответил на запрос обновления курсов: %s", exc)
+
+
+async def evict_idle_users(context: ContextTypes.DEFAULT_TYPE) -> None:
+    persistence = context.application.persistence
+    if isinstance(persistence, UserStatePersistence):
+        await persistence.evict(context.application)
+
+
+def schedule_background_jobs(application: Application) -> None:
+    if application.job_queue is None:
+        logger.warning(
+            "JobQueue недоступен (установите python-telegram-bot[job-queue]), "
+            "курсы будут обновляться только по запросам пользователей, а неактивные пользователи "
+            "не будут выгружаться из памяти."
+        )
+        return
+    if CLUSTER_WORKER_INDEX is not None:
+        application.job_queue.run_repeating(
+            sync_shared_rates_job, SHARED_RATES_POLL_INTERVAL, first=SHARED_RATES_POLL_INTERVAL, name="sync_rates"
+        )
+    else:
+        snapshot = RATE_CACHE.snapshot
+        first_delay = max(0.0, REFRESH_POLICY.interval - snapshot.age()) if snapshot else 0.0
+        application.job_queue.run_once(refresh_rates_job, first_delay, name="refresh_rates")
+    application.job_queue.run_repeating(
+        evict_idle_users, USER_STATE_FLUSH_INTERVAL, first=USER_STATE_FLUSH_INTERVAL, name="evict_idle_users"
+    )
+
+
+def _format_updated_at(snapshot: Optional[RateSnapshot]) -> str:
+    if snapshot is None:
+        return "🕒 Курсы ещё не загружены."
+    updated = time.strftime("%d.%m.%Y %H:%M:%S UTC", time.gmtime(snapshot.fetched_at))
+    return f"🕒 Обновлено: {updated}"
+
+
+# Rendered texts keyed by (snapshot version, variant); entries of older versions are dropped.
+_TEXT_CACHE: Dict[Tuple[int, str], str] = {}
+_TEXT_CACHE_VERSION = 0
+
+
+def _cached_text(snapshot: Optional[RateSnapshot], variant: str, render: Callable[[], str]) -> str:
+    global _TEXT_CACHE_VERSION
+    version = snapshot.version if snapshot else 0
+    if version != _TEXT_CACHE_VERSION:
+        _TEXT_CACHE.clear()
+        _TEXT_CACHE_VERSION = version
+    key = (version, variant)
+    text = _TEXT_CACHE.get(key)
+    if text is None:
+        text = _TEXT_CACHE[key] = render()
+    return text
+
+
+def build_welcome_message(
+    snapshot: Optional[RateSnapshot], favorites: Tuple[str, ...], *, refreshed: bool = False
+) -> str:
+    variant = f"welcome:{'refreshed' if refreshed else 'plain'}:{','.join(favorites)}"
+    return _cached_text(snapshot, variant, lambda: _render_welcome_message(snapshot, favorites, refreshed=refreshed))
+
+
+def _render_welcome_message(snapshot: Optional[RateSnapshot], favorites: Tuple[str, ...], *, refreshed: bool) -> str:
     header = [
         "✨ Добро пожаловать в конвертер валют!",
         "Здесь вы мгновенно узнаете актуальные курсы и можете конвертировать нужную сумму.",
@@ -127,33 +534,43 @@ def build_welcome_message(rates: Dict[str, Dict[str, float]], *, refreshed: bool
         header.append("✅ Курсы только что обновлены.")
 
     rates_block = [
-        "\n📊 Актуальные курсы:",
+        "\n📊 Курсы избранных валют:",
         "━━━━━━━━━━━━━━━━━━━━━━",
-        format_rates_summary(rates),
+        _cached_text(
+            snapshot,
+            f"summary:{','.join(favorites)}",
+            lambda: format_rates_summary(snapshot.rates if snapshot else {}, favorites),
+        ),
         "━━━━━━━━━━━━━━━━━━━━━━",
+        _format_updated_at(snapshot),
     ]
 
     menu_hint = [
         "\n📋 Меню действий:",
-        "• Нажмите на валюту, чтобы выбрать базовую.",
+        f"• Нажмите на валюту, чтобы выбрать базовую, или откройте 🌐 список всех {len(CURRENCIES)} валют и 🔍 поиск.",
         "• После выбора укажите валюту назначения и введите сумму.",
+        "• Кнопка ⭐ добавляет валюту в избранное — её курсы появятся в сводке выше.",
         "• Используйте кнопку 🔄, чтобы обновить данные в любой момент.",
+        "• /history USD RUB 30d — история курса за период.",
+        "• /alert USD RUB > 95 — уведомить, когда курс пересечёт порог.",
     ]
 
     return "\n".join(header + rates_block + menu_hint)
 
 
 async def send_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, *, refreshed: bool = False) -> None:
-    rates = await ensure_rates(context, force_refresh=refreshed)
-    message = build_welcome_message(rates, refreshed=refreshed)
-    reply_markup = build_main_menu()
+    context.user_data.pop("search", None)
+    favorites = user_favorites(context)
+    snapshot = await ensure_rates(context.application, force_refresh=refreshed)
+    message = build_welcome_message(snapshot, favorites, refreshed=refreshed)
+    reply_markup = build_main_menu(favorites)
 
     if update.message:
         await update.message.reply_text(message, reply_markup=reply_markup)
     elif update.callback_query:
         query = update.callback_query
         await query.answer()
-        await query.edit_message_text(message, reply_markup=reply_markup)
+        await edit_text_if_changed(query, message, reply_markup=reply_markup)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -164,19 +581,36 @@ async def refresh_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await send_main_menu(update, context, refreshed=True)
 
 
+def _callback_args(update: Update) -> List[str]:
+    return update.callback_query.data.split(":")[1:]
+
+
+def _page_number(value: str) -> Optional[int]:
+    return int(value) if value.isdigit() else None
+
+
 async def select_base_currency(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    base = query.data.split(":")[1]
+    args = _callback_args(update)
+    if len(args) != 1 or args[0] not in CURRENCY_SET:
+        return
+    base = args[0]
+    context.user_data.pop("search", None)
     context.user_data["selected_base"] = base
-    rates = await ensure_rates(context)
-    if base not in rates:
-        await query.edit_message_text("Курсы для выбранной валюты недоступны. Попробуйте обновить.", reply_markup=build_main_menu())
+    snapshot = current_rates()
+    if snapshot is None or base not in snapshot.rates:
+        await edit_text_if_changed(
+            query,
+            "Курсы для выбранной валюты недоступны. Попробуйте обновить.",
+            reply_markup=build_main_menu(user_favorites(context)),
+        )
         return
 
-    keyboard = build_target_menu(base)
-    await query.edit_message_text(
-        text=f"Выберите валюту, в которую хотите конвертировать {base}:",
+    keyboard = build_target_menu(base, user_favorites(context))
+    await edit_text_if_changed(
+        query,
+        f"Выберите валюту, в которую хотите конвертировать {base}:",
         reply_markup=keyboard,
     )
 
@@ -184,74 +618,677 @@ async def select_base_currency(update: Update, context: ContextTypes.DEFAULT_TYP
 async def select_target_currency(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    _, base, target = query.data.split(":")
+    args = _callback_args(update)
+    if len(args) != 2 or args[0] not in CURRENCY_SET or args[1] not in CURRENCY_SET or args[0] == args[1]:
+        return
+    base, target = args
+    context.user_data.pop("search", None)
     context.user_data["conversion"] = {"base": base, "target": target}
 
-    await query.edit_message_text(
-        text=(
+    await edit_text_if_changed(
+        query,
+        (
             f"Введите сумму в {base}, чтобы конвертировать в {target}.\n"
-            "Отправьте число сообщением."
+            "Отправьте число сообщением, список сумм (по одной в строке или через запятую с пробелом) "
+            "или CSV-файл."
         ),
         reply_markup=build_amount_keyboard(base, target),
     )
 
 
+async def show_currency_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    args = _callback_args(update)
+    await query.answer()
+    if len(args) == 2 and args[0] == "base" and (page := _page_number(args[1])) is not None:
+        await edit_text_if_changed(query, "Выберите базовую валюту:", reply_markup=build_base_page(page))
+    elif len(args) == 3 and args[0] == "target" and args[1] in CURRENCY_SET and (page := _page_number(args[2])) is not None:
+        await edit_markup_if_changed(query, build_target_menu(args[1], user_favorites(context), page))
+
+
+async def start_currency_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    args = _callback_args(update)
+    await query.answer()
+    if args == ["base"]:
+        base = None
+    elif len(args) == 2 and args[0] == "target" and args[1] in CURRENCY_SET:
+        base = args[1]
+    else:
+        return
+    context.user_data["search"] = base or ""
+    await edit_text_if_changed(
+        query,
+        "🔍 Отправьте код или название валюты, например JPY, евро или доллар.",
+        reply_markup=build_search_results([], base),
+    )
+
+
+async def handle_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    base = context.user_data.get("search") or None
+    matches = CURRENCY_SEARCH.find(update.message.text, CURRENCY_PAGE_SIZE)
+    if base is not None:
+        matches = [code for code in matches if code != base]
+    if not matches:
+        await update.message.reply_text(
+            "Ничего не найдено. Попробуйте другой код или название.",
+            reply_markup=build_search_results([], base),
+        )
+        return
+    text = f"Выберите валюту, в которую хотите конвертировать {base}:" if base else "Выберите базовую валюту:"
+    await update.message.reply_text(text, reply_markup=build_search_results(matches, base))
+
+
+async def toggle_favorite(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    args = _callback_args(update)
+    if len(args) != 1 or args[0] not in CURRENCY_SET:
+        await query.answer()
+        return
+    code = args[0]
+    favorites = list(user_favorites(context))
+    if code in favorites:
+        favorites.remove(code)
+        notice = f"{code} убрана из избранного."
+    elif len(favorites) >= FAVORITES_LIMIT:
+        await query.answer(f"В избранном может быть не более {FAVORITES_LIMIT} валют.", show_alert=True)
+        return
+    else:
+        favorites.append(code)
+        notice = f"{code} добавлена в избранное."
+    context.user_data["favorites"] = favorites
+    await query.answer(notice)
+    await edit_markup_if_changed(query, build_target_menu(code, tuple(favorites)))
+
+
+async def ignore_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.callback_query.answer()
+
+
 async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await send_main_menu(update, context)
 
 
-async def handle_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+Converter = Callable[[Decimal], Decimal]
+
+
+async def _selected_conversion(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> Optional[Tuple[str, str, Converter]]:
     conversion = context.user_data.get("conversion")
-    rates = context.user_data.get("rates")
+    snapshot = current_rates()
 
-    if not conversion or not rates:
+    if not conversion or snapshot is None:
         await update.message.reply_text("Сначала выберите направление конвертации через меню.")
-        return
+        return None
 
     base = conversion["base"]
     target = conversion["target"]
-    rate = rates.get(base, {}).get(target)
+    convert = conversion_table(snapshot).converter(base, target)
 
-    if rate in (None, 0):
+    if convert is None:
         await update.message.reply_text(
             "Курс недоступен. Обновите данные и попробуйте снова.",
-            reply_markup=build_main_menu(),
+            reply_markup=build_main_menu(user_favorites(context)),
         )
+        return None
+    return base, target, convert
+
+
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if "search" in context.user_data:
+        await handle_search(update, context)
+    else:
+        await handle_amount(update, context)
+
+
+async def handle_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    selected = await _selected_conversion(update, context)
+    if selected is None:
         return
+    base, target, convert = selected
 
     try:
-        amount = float(update.message.text.replace(",", "."))
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректное число.")
+        amounts = parse_amounts(update.message.text)
+    except ValueError as exc:
+        await update.message.reply_text(f"Пожалуйста, введите корректное число (не понял: {exc}).")
+        return
+
+    if len(amounts) == 1:
+        amount = amounts[0]
+        message = f"{format_money(amount, base)} {base} = {convert(amount)} {target}"
+        await update.message.reply_text(message, reply_markup=build_result_keyboard(base, target))
+        return
+
+    totals = BatchTotals()
+    rows = convert_amounts(amounts, convert, totals)
+    if len(amounts) <= BATCH_TABLE_LIMIT:
+        message = format_batch_table(rows, base, target, totals)
+        await update.message.reply_text(message, reply_markup=build_result_keyboard(base, target))
+        return
+
+    buffer = io.StringIO()
+    write_batch_csv(rows, buffer, base, target, totals)
+    await update.message.reply_document(
+        document=buffer.getvalue().encode("utf-8"),
+        filename=f"{base}_{target}.csv",
+        caption=format_totals(base, target, totals),
+        reply_markup=build_result_keyboard(base, target),
+    )
+
+
+def _convert_csv_file(source: Path, destination: Path, base: str, target: str, convert: Converter) -> BatchTotals:
+    totals = BatchTotals()
+    with source.open(encoding="utf-8-sig", errors="replace", newline="") as src, destination.open(
+        "w", encoding="utf-8", newline=""
+    ) as dst:
+        amounts = (amount for _, amount in iter_csv_amounts(src))
+        write_batch_csv(convert_amounts(amounts, convert, totals), dst, base, target, totals)
+    return totals
+
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    document = update.message.document
+    if document.file_size and document.file_size > BATCH_MAX_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой: Telegram позволяет ботам скачивать не более 20 МБ.")
+        return
+
+    selected = await _selected_conversion(update, context)
+    if selected is None:
+        return
+    base, target, convert = selected
+
+    with tempfile.TemporaryDirectory(prefix="exchange_bot_") as tmp:
+        source = Path(tmp) / "input.csv"
+        destination = Path(tmp) / f"{base}_{target}.csv"
+        telegram_file = await context.bot.get_file(document.file_id)
+        await telegram_file.download_to_drive(source)
+        totals = await asyncio.to_thread(_convert_csv_file, source, destination, base, target, convert)
+
+        if not totals.count:
+            await update.message.reply_text("В файле не найдено ни одной суммы.")
+            return
+        with destination.open("rb") as handle:
+            await update.message.reply_document(
+                document=handle,
+                filename=destination.name,
+                caption=format_totals(base, target, totals),
+                reply_markup=build_result_keyboard(base, target),
+            )
+
+
+def _inline_cache_time(snapshot: RateSnapshot) -> int:
+    # Telegram may reuse the answer until the next background refresh is due.
+    horizon = min(RATE_CACHE.ttl, REFRESH_POLICY.interval)
+    return int(max(0.0, horizon - snapshot.age()))
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.inline_query
+    snapshot = current_rates()
+    parsed = parse_query(query.query, CURRENCY_SET)
+    if snapshot is None or parsed is None:
+        await query.answer([], cache_time=0)
+        return
+
+    table = conversion_table(snapshot)
+    amount_text = format_money(parsed.amount, parsed.base)
+    results = []
+    for target in query_targets(parsed, user_favorites(context) or DEFAULT_FAVORITES):
+        rate = snapshot.rate(parsed.base, target)
+        result = table.convert(parsed.amount, parsed.base, target)
+        if result is None:
+            continue
+        text = f"{amount_text} {parsed.base} = {result} {target}"
+        results.append(
+            InlineQueryResultArticle(
+                id=f"{snapshot.version}:{parsed.base}:{target}",
+                title=text,
+                description=f"1 {parsed.base} = {_format_rate(rate)} {target}",
+                input_message_content=InputTextMessageContent(text),
+            )
+        )
+    # Targets come from the user's favorites, so the cached answer must stay per user.
+    await query.answer(results, cache_time=_inline_cache_time(snapshot), is_personal=True)
+
+
+def parse_history_period(value: str) -> Optional[int]:
+    match = HISTORY_PERIOD_RE.match(value.lower())
+    if not match:
+        return None
+    period = int(match.group(1)) * HISTORY_PERIOD_UNITS[match.group(2)]
+    return period if 0 < period <= HISTORY_MAX_PERIOD else None
+
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    args = [arg.upper() for arg in context.args]
+    usage = (
+        "Использование: /history USD RUB 30d\n"
+        "Период: число и единица — h (часы), d (дни), w (недели), m (месяцы), y (годы); не больше 10y."
+    )
+    if len(args) not in (2, 3):
+        await update.message.reply_text(usage)
+        return
+
+    base, target = args[0], args[1]
+    period_text = args[2].lower() if len(args) == 3 else HISTORY_DEFAULT_PERIOD
+    period = parse_history_period(period_text)
+    if base not in CURRENCY_SET or target not in CURRENCY_SET or base == target or not period:
+        await update.message.reply_text(usage)
+        return
+    if not RATE_HISTORY.tracks(base, target):
+        await update.message.reply_text(f"История хранится только для валют: {', '.join(HISTORY_CURRENCIES)}.")
+        return
+
+    until = int(time.time())
+    stats = await asyncio.to_thread(RATE_HISTORY.query, base, target, until - period, until)
+    if stats is None:
+        await update.message.reply_text(f"История {base} → {target} за {period_text} пока пуста.")
+        return
+
+    message = "\n".join(
+        [
+            f"📈 {base} → {target} за {period_text}",
+            f"Мин: {_format_rate(stats.minimum)}",
+            f"Макс: {_format_rate(stats.maximum)}",
+            f"Среднее: {_format_rate(stats.mean)}",
+            stats.sparkline(),
+            f"Наблюдений: {stats.samples}",
+        ]
+    )
+    await update.message.reply_text(message)
+
+
+async def alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    usage = "Использование: /alert USD RUB > 95 (или < 90). Список: /alerts, удалить: /unalert <номер>."
+    match = ALERT_RE.match(" ".join(context.args).upper())
+    if not match:
+        await update.message.reply_text(usage)
+        return
+
+    base, target, direction, threshold_text = match.groups()
+    if base not in CURRENCY_SET or target not in CURRENCY_SET or base == target:
+        await update.message.reply_text(usage)
+        return
+
+    chat_id = update.effective_chat.id
+    if len(ALERT_INDEX.for_chat(chat_id)) >= ALERTS_PER_CHAT:
+        await update.message.reply_text(f"Можно держать не более {ALERTS_PER_CHAT} активных уведомлений.")
+        return
+
+    threshold = float(threshold_text.replace(",", "."))
+    created = await asyncio.to_thread(ALERT_STORE.add, chat_id, base, target, direction, threshold)
+    ALERT_INDEX.add(created)
+
+    snapshot = current_rates()
+    current = snapshot.rate(base, target) if snapshot else None
+    await update.message.reply_text(
+        f"🔔 Уведомление #{created.id}: {created.describe()}.\n"
+        f"Текущий курс: {_format_rate(current)}."
+    )
+
+
+async def list_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    active = ALERT_INDEX.for_chat(update.effective_chat.id)
+    if not active:
+        await update.message.reply_text("Активных уведомлений нет. Создайте: /alert USD RUB > 95")
+        return
+    lines = ["🔔 Активные уведомления:"] + [f"#{item.id}: {item.describe()}" for item in active]
+    await update.message.reply_text("\n".join(lines))
+
+
+async def remove_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if len(context.args) != 1 or not context.args[0].lstrip("#").isdigit():
+        await update.message.reply_text("Использование: /unalert <номер>")
+        return
+
+    alert_id = int(context.args[0].lstrip("#"))
+    owned = {item.id for item in ALERT_INDEX.for_chat(update.effective_chat.id)}
+    if alert_id not in owned:
+        await update.message.reply_text(f"Уведомление #{alert_id} не найдено.")
         return
+    ALERT_INDEX.remove(alert_id)
+    await asyncio.to_thread(ALERT_STORE.delete, [alert_id])
+    await update.message.reply_text(f"Уведомление #{alert_id} удалено.")
 
-    result = amount * rate
-    message = f"{amount:.2f} {base} = {result:.2f} {target}"
 
-    await update.message.reply_text(message, reply_markup=build_result_keyboard(base, target))
+async def check_alerts(application: Application, snapshot: RateSnapshot) -> None:
+    triggered = ALERT_INDEX.match_rates(snapshot.rates)
+    if not triggered:
+        return
+    await asyncio.to_thread(ALERT_STORE.delete, [item.id for item in triggered])
+
+    notifier: NotificationSender = application.bot_data["notifier"]
+    for chat_id, items in group_by_chat(triggered).items():
+        lines = ["🔔 Сработали уведомления:"]
+        for item in items:
+            lines.append(f"#{item.id}: {item.describe()} — сейчас {_format_rate(snapshot.rate(item.base, item.target))}")
+        notifier.enqueue(chat_id, "\n".join(lines))
+
+
+async def post_init(application: Application) -> None:
+    for stored in await asyncio.to_thread(ALERT_STORE.load):
+        # A worker only checks the alerts of the chats routed to it.
+        if CLUSTER_WORKER_INDEX is None or stored.chat_id % WORKERS == CLUSTER_WORKER_INDEX:
+            ALERT_INDEX.add(stored)
+    send_rate = _per_process(ALERTS_SEND_RATE)
+    notifier = NotificationSender(application.bot.send_message, rate=send_rate, burst=send_rate)
+    notifier.start()
+    application.bot_data["notifier"] = notifier
+    if CLUSTER_WORKER_INDEX is not None:
+        application.bot_data["shared_rates"] = SharedSnapshot.open(SHARED_RATES_PATH)
+        await sync_shared_rates(application)
+    else:
+        RATE_CACHE.add_listener(partial(check_alerts, application))
+    register_gauges(application)
+    await start_metrics_server(application, lambda: application.running and current_rates() is not None)
+
+
+async def start_metrics_server(application: Application, readiness: Callable[[], bool]) -> None:
+    if not METRICS_PORT:
+        return
+    # Every process of a cluster gets its own port: the leader METRICS_PORT, worker i the port + 1 + i.
+    port = METRICS_PORT if CLUSTER_WORKER_INDEX is None else METRICS_PORT + 1 + CLUSTER_WORKER_INDEX
+    server = WebhookServer(
+        application,
+        host=METRICS_LISTEN,
+        port=port,
+        path=None,
+        readiness=readiness,
+        metrics=REGISTRY.render,
+    )
+    await server.start()
+    application.bot_data["metrics_server"] = server
+    logger.info("Метрики доступны на http://%s:%s/metrics", METRICS_LISTEN, server.port)
+
+
+def register_gauges(application: Application) -> None:
+    """Point the scrape-time gauges at the live objects they describe."""
+
+    RATES_AGE.set_function(lambda: {} if (age := RATE_CACHE.status().age) is None else {(): age})
+    RATES_STALE.set_function(lambda: float(RATE_CACHE.status().stale))
+    RATES_VERSION.set_function(lambda: RATE_CACHE.status().version)
+    REFRESH_FAILURES.set_function(lambda: RATE_CACHE.status().consecutive_failures)
+    CIRCUIT_OPEN.set_function(lambda: float(RATE_CACHE.status().circuit_open))
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+    notifier = application.bot_data.get("notifier")
+    if notifier is not None:
+        NOTIFICATION_QUEUE_DEPTH.set_function(notifier.pending)
+    ACTIVE_ALERTS.set_function(lambda: len(ALERT_INDEX))
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print(f"Произошла ошибка: {context.error}")
+    logger.error("Произошла ошибка: %s", context.error, exc_info=context.error)
 
 
-def main() -> None:
-    application = Application.builder().token(BOT_TOKEN).build()
+async def shutdown(application: Application) -> None:
+    metrics_server = application.bot_data.get("metrics_server")
+    if metrics_server is not None:
+        await metrics_server.stop()
+    notifier = application.bot_data.get("notifier")
+    if notifier is not None:
+        await notifier.stop()
+    shared = application.bot_data.get("shared_rates")
+    if shared is not None:
+        shared.close()
+    ALERT_STORE.close()
+    await RATE_FETCHER.aclose()
+    RATE_HISTORY.close()
+
+
+# Callback data is "<action>[:<arg>...]"; the action picks the handler with one
+# dict lookup and the handler validates its own arguments.
+CALLBACK_ROUTES: Dict[str, Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]] = {
+    action: timed_handler(f"callback:{action}", handler)
+    for action, handler in {
+        "refresh_rates": refresh_rates,
+        "base": select_base_currency,
+        "target": select_target_currency,
+        "page": show_currency_page,
+        "search": start_currency_search,
+        "fav": toggle_favorite,
+        "back": back_to_main,
+        "noop": ignore_callback,
+    }.items()
+}
+
+
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    handler = CALLBACK_ROUTES.get((query.data or "").split(":", 1)[0], CALLBACK_ROUTES["noop"])
+    await handler(update, context)
 
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(refresh_rates, pattern="^refresh_rates$"))
-    application.add_handler(CallbackQueryHandler(select_base_currency, pattern=r"^base:(RUB|USD|EUR|CNY)$"))
+
+def _application_builder(request: Optional[BaseRequest]) -> ApplicationBuilder:
+    builder = Application.builder().token(BOT_TOKEN)
+    if request is not None:
+        builder = builder.request(request)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+    return builder
+
+
+def build_application(request: Optional[BaseRequest] = None) -> Application:
+    """Build the bot; *request* replaces the HTTP transport to the Bot API (used by bench_bot.py)."""
+
+    builder = _application_builder(request)
+    if TELEGRAM_SEND_RATE > 0:
+        builder = builder.rate_limiter(SendScheduler(_per_process(TELEGRAM_SEND_RATE), TELEGRAM_GROUP_SEND_RATE))
+    application = (
+        builder
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .persistence(
+            UserStatePersistence(
+                USER_STATE_DB_PATH,
+                update_interval=USER_STATE_FLUSH_INTERVAL,
+                capacity=USER_STATE_CACHE_SIZE,
+                idle_ttl=USER_STATE_IDLE_TTL,
+            )
+        )
+        .post_init(post_init)
+        .post_shutdown(shutdown)
+        .build()
+    )
+
+    # Group -1 runs before the handlers below and stops throttled and duplicate updates.
+    application.add_handler(
+        TypeHandler(Update, FloodControl(FLOOD_USER_RATE, FLOOD_USER_BURST, FLOOD_COALESCE_WINDOW)), group=-1
+    )
+    application.add_handler(CommandHandler("start", timed_handler("start", start)))
+    application.add_handler(CommandHandler("history", timed_handler("history", history)))
+    application.add_handler(CommandHandler("alert", timed_handler("alert", alert)))
+    application.add_handler(CommandHandler("alerts", timed_handler("alerts", list_alerts)))
+    application.add_handler(CommandHandler("unalert", timed_handler("unalert", remove_alert)))
+    application.add_handler(CallbackQueryHandler(dispatch_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler("text", handle_text)))
+    application.add_handler(InlineQueryHandler(timed_handler("inline", inline_query)))
     application.add_handler(
-        CallbackQueryHandler(
-            select_target_currency,
-            pattern=r"^target:(RUB|USD|EUR|CNY):(RUB|USD|EUR|CNY)$",
+        MessageHandler(
+            filters.Document.FileExtension("csv") | filters.Document.MimeType("text/csv"),
+            timed_handler("document", handle_document),
         )
     )
-    application.add_handler(CallbackQueryHandler(back_to_main, pattern="^back:main$"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_amount))
     application.add_error_handler(error_handler)
+    return application
+
+
+# --- Multi-worker mode (WORKERS > 0) ------------------------------------------------
+#
+# The leader receives updates (polling or webhook) and refreshes the rates; the
+# workers it starts run the handlers above, each for the chats routed to it.
+
+
+async def forward_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat, user = update.effective_chat, update.effective_user
+    key = chat.id if chat is not None else user.id if user is not None else 0
+    await context.bot_data["workers"].route(key, {"update": update.to_dict()})
+
+
+async def handle_worker_message(application: Application, index: int, message: Dict[str, object]) -> None:
+    if message.get("refresh"):
+        application.create_task(_refresh_for_worker(application, index, message.get("id")))
+
+
+async def _refresh_for_worker(application: Application, index: int, call_id: object) -> None:
+    snapshot = await RATE_CACHE.refresh(force=True)
+    await application.bot_data["workers"].send(index, {"reply_to": call_id, "version": snapshot.version if snapshot else 0})
+
+
+async def leader_post_init(application: Application) -> None:
+    shared = SharedSnapshot.create(SHARED_RATES_PATH, CURRENCIES)
+    application.bot_data["shared_rates"] = shared
+    if RATE_CACHE.snapshot is not None:
+        shared.publish(RATE_CACHE.snapshot)
+    RATE_CACHE.add_listener(partial(publish_shared_rates, shared))
+
+    pool = WorkerPool(
+        WORKERS,
+        CLUSTER_SOCKET_PATH,
+        [sys.executable, str(Path(__file__).resolve())],
+        os.environ,
+        partial(handle_worker_message, application),
+        status_path=CLUSTER_STATUS_PATH,
+    )
+    await pool.start()
+    application.bot_data["workers"] = pool
+    register_gauges(application)
+    CLUSTER_WORKERS_CONNECTED.set_function(pool.connected)
+    await start_metrics_server(
+        application, lambda: application.running and current_rates() is not None and pool.connected() == WORKERS
+    )
+    logger.info("Запущено воркеров: %d", WORKERS)
+
+
+async def leader_shutdown(application: Application) -> None:
+    pool = application.bot_data.get("workers")
+    if pool is not None:
+        await pool.stop()
+    metrics_server = application.bot_data.get("metrics_server")
+    if metrics_server is not None:
+        await metrics_server.stop()
+    shared = application.bot_data.get("shared_rates")
+    if shared is not None:
+        shared.close()
+    ALERT_STORE.close()
+    await RATE_FETCHER.aclose()
+    RATE_HISTORY.close()
+
+
+def build_leader_application(request: Optional[BaseRequest] = None) -> Application:
+    """Build the leader: no handlers of its own, every update is routed to a worker."""
+
+    builder = _application_builder(request)
+    application = builder.post_init(leader_post_init).post_shutdown(leader_shutdown).build()
+    # Updates are routed one at a time so every worker sees a chat's updates in order.
+    application.add_handler(TypeHandler(Update, forward_update))
+    application.add_error_handler(error_handler)
+    return application
+
+
+async def run_worker(application: Application) -> None:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async def consume() -> None:
+        async for message in LEADER_LINK.messages():
+            if "update" in message:
+                await application.update_queue.put(Update.de_json(message["update"], application.bot))
+        logger.warning("Ведущий процесс закрыл соединение, воркер %d завершается", CLUSTER_WORKER_INDEX)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    tasks = []
+    try:
+        await application.start()
+        await LEADER_LINK.connect()
+        tasks = [loop.create_task(consume()), loop.create_task(stop_event.wait())]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        LEADER_LINK.close()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def run_webhook(application: Application) -> None:
+    server = WebhookServer(
+        application,
+        host=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        readiness=lambda: application.running and current_rates() is not None,
+    )
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await server.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        logger.info("Webhook-сервер слушает %s:%s%s", WEBHOOK_LISTEN, server.port, WEBHOOK_PATH)
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def main() -> None:
+    log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT)
+    try:
+        run_bot()
+    finally:
+        log_listener.stop()
+
+
+def prepare_application(request: Optional[BaseRequest] = None) -> Application:
+    """Build the process's Application: single-process bot, cluster leader or worker."""
+
+    if CLUSTER_WORKER_INDEX is None and WORKERS > 0:
+        application = build_leader_application(request)
+    else:
+        application = build_application(request)
+
+    if CLUSTER_WORKER_INDEX is None:
+        restore_rates()
+        RATE_CACHE.add_listener(persist_snapshot)
+        RATE_CACHE.add_listener(record_history)
+    schedule_background_jobs(application)
+    return application
+
+
+def run_bot() -> None:
+    application = prepare_application()
+
+    if CLUSTER_WORKER_INDEX is not None:
+        asyncio.run(run_worker(application))
+        return
 
-    application.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+"""Flood control in front of the handlers and behind the Bot API calls.
+
+``FloodControl`` runs before every handler: it gives each user a token bucket
+and answers repeated taps on the same button without running the handler
+again.  ``SendScheduler`` is installed as the Application's rate limiter and
+keeps outgoing messages under Telegram's limits, pausing everything when
+Telegram answers with flood control (429).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set, Tuple, Union
+
+from telegram import CallbackQuery, InlineKeyboardMarkup, Message, Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import ApplicationHandlerStop, BaseRateLimiter, ContextTypes
+
+from metrics import EDITS_SKIPPED, SEND_WAIT, TELEGRAM_FLOOD_WAITS, UPDATES_DROPPED
+from throttling import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "⏳ Слишком много запросов. Подождите пару секунд и попробуйте снова."
+
+# Idle buckets and old callback keys are dropped at most this often.
+_PRUNE_INTERVAL = 60.0
+
+
+def _is_full(bucket: TokenBucket, now: float) -> bool:
+    return bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity
+
+
+class FloodControl:
+    """Per-user token buckets and coalescing of identical callback queries.
+
+    Register the instance as a ``TypeHandler(Update, ...)`` in a group that
+    runs before the regular handlers.  A rejected update is answered cheaply
+    (a callback answer, or a single notice per burst for messages) and
+    ``ApplicationHandlerStop`` keeps the handlers from running.  A *rate* of
+    0 turns the per-user buckets off; coalescing still applies.
+    """
+
+    def __init__(self, rate: float, burst: float, coalesce_window: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_window = coalesce_window
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._notified: Set[int] = set()
+        # (user, message, callback data) -> monotonic time the query was first seen.
+        self._recent: Dict[Tuple[int, int, str], float] = {}
+        self._pruned = time.monotonic()
+
+    def allow(self, user_id: int) -> bool:
+        if self.rate <= 0:
+            return True
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        if bucket.try_acquire():
+            self._notified.discard(user_id)
+            return True
+        return False
+
+    def is_duplicate(self, user_id: int, message_id: int, data: str, now: float) -> bool:
+        key = (user_id, message_id, data)
+        seen = self._recent.get(key)
+        if seen is not None and now - seen < self.coalesce_window:
+            return True
+        self._recent[key] = now
+        return False
+
+    def prune(self, now: float) -> None:
+        self._recent = {key: seen for key, seen in self._recent.items() if now - seen < self.coalesce_window}
+        idle = [user_id for user_id, bucket in self._buckets.items() if _is_full(bucket, now)]
+        for user_id in idle:
+            del self._buckets[user_id]
+            self._notified.discard(user_id)
+        self._pruned = now
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if user is None or update.inline_query is not None:
+            return
+        now = time.monotonic()
+        if now - self._pruned > _PRUNE_INTERVAL:
+            self.prune(now)
+
+        query = update.callback_query
+        if query is not None:
+            message_id = query.message.message_id if query.message else 0
+            if self.is_duplicate(user.id, message_id, query.data or "", now):
+                UPDATES_DROPPED.inc("duplicate")
+                await self._answer(query.answer())
+                raise ApplicationHandlerStop
+            if not self.allow(user.id):
+                UPDATES_DROPPED.inc("throttled")
+                await self._answer(query.answer(THROTTLED_TEXT))
+                raise ApplicationHandlerStop
+        elif update.message is not None and not self.allow(user.id):
+            UPDATES_DROPPED.inc("throttled")
+            if user.id not in self._notified:
+                self._notified.add(user.id)
+                await self._answer(update.message.reply_text(THROTTLED_TEXT))
+            raise ApplicationHandlerStop
+
+    @staticmethod
+    async def _answer(call: Coroutine[Any, Any, object]) -> None:
+        try:
+            await call
+        except TelegramError as exc:
+            logger.debug("Не удалось ответить ограниченному пользователю: %s", exc)
+
+
+async def edit_text_if_changed(
+    query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None
+) -> bool:
+    """Edit the query's message unless it already shows *text* and *reply_markup*.
+
+    Returns whether an edit was sent.
+    """
+
+    message = query.message
+    if isinstance(message, Message) and message.text == text and message.reply_markup == reply_markup:
+        EDITS_SKIPPED.inc()
+        return False
+    return await _edit(query.edit_message_text(text, reply_markup=reply_markup))
+
+
+async def edit_markup_if_changed(query: CallbackQuery, reply_markup: InlineKeyboardMarkup) -> bool:
+    message = query.message
+    if isinstance(message, Message) and message.reply_markup == reply_markup:
+        EDITS_SKIPPED.inc()
+        return False
+    return await _edit(query.edit_message_reply_markup(reply_markup))
+
+
+async def _edit(call: Coroutine[Any, Any, object]) -> bool:
+    try:
+        await call
+    except BadRequest as exc:
+        # The message in the callback may be older than what the chat shows.
+        if "message is not modified" not in str(exc).lower():
+            raise
+        EDITS_SKIPPED.inc()
+        return False
+    return True
+
+
+RequestResult = Union[bool, Dict[str, Any], List[Dict[str, Any]]]
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Global outbound scheduler for Bot API calls that post into a chat.
+
+    Calls carrying a ``chat_id`` wait, in arrival order, for a token of the
+    global bucket (*rate* per second); calls into groups and channels also
+    wait for their chat's bucket (*group_rate* per minute).  Other calls —
+    ``getUpdates``, callback and inline answers — are not delayed.  When
+    Telegram replies with ``RetryAfter`` every chat call is paused for that
+    long and the call is retried up to *max_retries* times; the optional
+    ``rate_limit_args`` of a call overrides that number.
+    """
+
+    def __init__(self, rate: float = 30.0, group_rate: float = 20.0, max_retries: int = 3) -> None:
+        self.rate = rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, rate)
+        self._group_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._order = asyncio.Lock()
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._pruned = time.monotonic()
+
+    async def initialize(self) -> None:
+        return None
+
+    async def shutdown(self) -> None:
+        return None
+
+    def _group_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        now = time.monotonic()
+        if now - self._pruned > _PRUNE_INTERVAL:
+            self._group_buckets = {
+                key: bucket for key, bucket in self._group_buckets.items() if not _is_full(bucket, now)
+            }
+            self._pruned = now
+        bucket = self._group_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._group_buckets[chat_id] = TokenBucket(self.group_rate / 60, self.group_rate)
+        return bucket
+
+    async def _wait_turn(self, chat_id: Union[int, str]) -> None:
+        started = time.perf_counter()
+        await self._resume.wait()
+        if isinstance(chat_id, str) or chat_id < 0:
+            await self._group_bucket(chat_id).acquire()
+        async with self._order:
+            await self._bucket.acquire()
+        SEND_WAIT.observe(time.perf_counter() - started)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, RequestResult]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> RequestResult:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                TELEGRAM_FLOOD_WAITS.inc()
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                retry_after = exc.retry_after
+                delay = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                logger.warning(
+                    "Telegram ограничил отправку (%s), пауза %.1f с", endpoint, delay, extra={"chat_id": chat_id}
+                )
+                if self._resume.is_set():
+                    self._resume.clear()
+                    try:
+                        await asyncio.sleep(delay + 0.1)
+                    finally:
+                        self._resume.set()
@@ -0,0 +1,279 @@
+"""Dependency-free metrics registry rendered in the Prometheus text exposition format."""
+from __future__ import annotations
+
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, TypeVar, Union
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+GaugeFunction = Callable[[], Union[float, Mapping[LabelValues, float]]]
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _check(self, labels: LabelValues) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {labels}")
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._check(labels)
+        self._values[labels] += amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}_total", self.labelnames, labels, value
+
+
+class Gauge(Metric):
+    """A value that goes up and down; either set directly or read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[GaugeFunction] = None
+
+    def set(self, value: float, *labels: str) -> None:
+        self._check(labels)
+        self._values[labels] = value
+
+    def set_function(self, function: GaugeFunction) -> None:
+        self._function = function
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        values: Mapping[LabelValues, float] = self._values
+        if self._function is not None:
+            result = self._function()
+            values = result if isinstance(result, Mapping) else {(): result}
+        for labels, value in sorted(values.items()):
+            yield self.name, self.labelnames, labels, value
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram; ``observe`` is one bisect and two additions."""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last slot is +Inf) and the sum.
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = defaultdict(float)
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            self._check(labels)
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        bucket_labels = (*self.labelnames, "le")
+        for labels, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", bucket_labels, (*labels, _format_value(bound)), cumulative
+            yield f"{self.name}_sum", self.labelnames, labels, self._sums[labels]
+            yield f"{self.name}_count", self.labelnames, labels, cumulative
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as exc:  # noqa: BLE001
+                lines.append(f"# {metric.name} недоступна: {exc}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed_handler(name: str, handler: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Wrap an async handler so its latency and failures are recorded under *name*."""
+
+    async def wrapper(*args, **kwargs) -> T:
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+    wrapper.__name__ = getattr(handler, "__name__", name)
+    wrapper.__doc__ = handler.__doc__
+    return wrapper
+
+
+# --- Reading the exposition format (used by ``bot_cli.py stats``) -------------------
+
+_SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)")
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_exposition(text: str) -> List[Sample]:
+    samples: List[Sample] = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        name, labels_text, value = match.groups()
+        labels = {
+            key: raw.replace('\\"', '"').replace("\\n", "\n").replace("\\\\", "\\")
+            for key, raw in _LABEL_RE.findall(labels_text or "")
+        }
+        try:
+            samples.append((name, labels, float(value)))
+        except ValueError:
+            continue
+    return samples
+
+
+def histogram_quantile(quantile: float, buckets: Sequence[Tuple[float, float]]) -> Optional[float]:
+    """Estimate a quantile from cumulative ``(upper bound, count)`` pairs, like PromQL does."""
+
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = quantile * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+# --- Metrics of the bot ---------------------------------------------------------------
+
+HANDLER_LATENCY = Histogram(
+    "exchange_bot_handler_duration_seconds", "Time spent in an update handler.", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "exchange_bot_handler_errors", "Update handlers that raised an exception.", ("handler",)
+)
+UPSTREAM_LATENCY = Histogram(
+    "exchange_bot_upstream_duration_seconds", "Duration of a rates request to one provider.", ("provider",)
+)
+UPSTREAM_REQUESTS = Counter(
+    "exchange_bot_upstream_requests",
+    "Rates requests by provider and outcome (ok, error, rate_limited, cancelled); every request counts against the quota.",
+    ("provider", "outcome"),
+)
+CACHE_LOOKUPS = Counter(
+    "exchange_bot_rate_cache_lookups", "Rate cache lookups by result (hit, stale, miss).", ("result",)
+)
+RATES_AGE = Gauge("exchange_bot_rates_age_seconds", "Age of the rates snapshot being served.")
+RATES_STALE = Gauge("exchange_bot_rates_stale", "1 while the snapshot being served is older than RATES_TTL.")
+RATES_VERSION = Gauge("exchange_bot_rates_version", "Version of the rates snapshot being served.")
+REFRESH_FAILURES = Gauge("exchange_bot_rates_refresh_failures", "Failed rates refreshes in a row.")
+CIRCUIT_OPEN = Gauge("exchange_bot_rates_circuit_open", "1 while rates refreshes are paused after failures.")
+UPDATE_QUEUE_DEPTH = Gauge("exchange_bot_update_queue_depth", "Updates received but not yet picked up.")
+NOTIFICATION_QUEUE_DEPTH = Gauge("exchange_bot_notification_queue_depth", "Alert notifications waiting to be sent.")
+ACTIVE_ALERTS = Gauge("exchange_bot_alerts_active", "Rate alerts waiting to trigger.")
+UPDATES_DROPPED = Counter(
+    "exchange_bot_updates_dropped",
+    "Updates answered without running a handler by reason (throttled, duplicate).",
+    ("reason",),
+)
+EDITS_SKIPPED = Counter("exchange_bot_edits_skipped", "Message edits skipped because the content was unchanged.")
+SEND_WAIT = Histogram(
+    "exchange_bot_send_wait_seconds", "Time a Bot API call into a chat waited for the send scheduler."
+)
+TELEGRAM_FLOOD_WAITS = Counter("exchange_bot_telegram_flood_waits", "Bot API calls answered with RetryAfter (429).")
+CLUSTER_WORKERS_CONNECTED = Gauge(
+    "exchange_bot_cluster_workers_connected", "Worker processes connected to the leader (multi-worker mode)."
+)
@@ -0,0 +1,139 @@
+"""Exact Decimal conversion with per-currency minor units and rounding rules."""
+from __future__ import annotations
+
+from decimal import ROUND_HALF_UP, Context, Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from rates import RatesMatrix, RateSnapshot
+
+DEFAULT_MINOR_UNITS = 2
+DEFAULT_ROUNDING = ROUND_HALF_UP
+MAX_AMOUNT = Decimal("1e18")
+# An amount has at most MAX_DIGITS significant digits and a rate (the repr of a
+# float) at most 17, so every product fits PRECISION digits and is exact.
+MAX_DIGITS = 36
+PRECISION = 60
+
+# ISO 4217 exponents that differ from the default of two decimal places.
+MINOR_UNITS: Dict[str, int] = {
+    "BHD": 3, "BIF": 0, "CLF": 4, "CLP": 0, "DJF": 0, "GNF": 0, "IQD": 3, "ISK": 0,
+    "JOD": 3, "JPY": 0, "KMF": 0, "KRW": 0, "KWD": 3, "LYD": 3, "OMR": 3, "PYG": 0,
+    "RWF": 0, "TND": 3, "UGX": 0, "UYI": 0, "UYW": 4, "VND": 0, "VUV": 0, "XAF": 0,
+    "XOF": 0, "XPF": 0,
+}
+
+# Currencies whose amounts are rounded differently from the default half-up.
+ROUNDING_MODES: Dict[str, str] = {}
+
+
+def minor_units(currency: str) -> int:
+    return MINOR_UNITS.get(currency, DEFAULT_MINOR_UNITS)
+
+
+@lru_cache(maxsize=None)
+def _context(rounding: str) -> Context:
+    # Context.quantize with the rounding baked into the context is several
+    # times cheaper than Decimal.quantize(..., rounding=...) per call.
+    return Context(prec=PRECISION, rounding=rounding)
+
+
+@lru_cache(maxsize=None)
+def rounding_rule(currency: str) -> Tuple[Decimal, Context]:
+    """``(quantum, context)`` of *currency*, built once per currency."""
+
+    return Decimal(1).scaleb(-minor_units(currency)), _context(ROUNDING_MODES.get(currency, DEFAULT_ROUNDING))
+
+
+def quantum(currency: str) -> Decimal:
+    return rounding_rule(currency)[0]
+
+
+def round_money(value: Decimal, currency: str) -> Decimal:
+    target_quantum, context = rounding_rule(currency)
+    return context.quantize(value, target_quantum)
+
+
+def format_money(value: Decimal, currency: str) -> str:
+    # A quantized value has at most four fractional digits, so str() never
+    # switches to exponent notation and is much cheaper than format(..., "f").
+    return str(round_money(value, currency))
+
+
+def to_decimal(value: str) -> Optional[Decimal]:
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or abs(number) >= MAX_AMOUNT or len(number.as_tuple().digits) > MAX_DIGITS:
+        return None
+    return number
+
+
+class ConversionTable:
+    """Decimal rates and target rounding rules of one snapshot.
+
+    Rates are taken from the shortest ``repr`` of the upstream floats, so
+    ``Decimal`` sees exactly the digits the API published (or the correctly
+    rounded cross rate), and every conversion is a single exact multiply
+    plus a quantize to the target's minor unit.  Results are therefore
+    already rounded: ``str(result)`` is their display form and skips the
+    second quantize :func:`format_money` would do.
+
+    A pair is prepared the first time it is used and kept for the lifetime of
+    the snapshot, so building a table does not grow with the currency count.
+    Its converter is built once as well; each call is then two libmpdec calls.
+    (Scaled integers are no faster here: turning a ``Decimal`` into an integer
+    and back costs more than the multiply and quantize themselves.)
+    """
+
+    __slots__ = ("_rates", "_pairs")
+
+    def __init__(self, rates: RatesMatrix) -> None:
+        self._rates = rates
+        self._pairs: Dict[Tuple[str, str], Optional[Tuple[Decimal, Callable[[Decimal], Decimal]]]] = {}
+
+    def _pair(self, base: str, target: str) -> Optional[Tuple[Decimal, Callable[[Decimal], Decimal]]]:
+        key = (base, target)
+        try:
+            return self._pairs[key]
+        except KeyError:
+            pass
+        rate = self._rates.get(base, {}).get(target)
+        pair = self._pairs[key] = _prepare(Decimal(repr(rate)), target) if rate else None
+        return pair
+
+    def rate(self, base: str, target: str) -> Optional[Decimal]:
+        pair = self._pair(base, target)
+        return pair[0] if pair else None
+
+    def convert(self, amount: Decimal, base: str, target: str) -> Optional[Decimal]:
+        pair = self._pair(base, target)
+        return pair[1](amount) if pair else None
+
+    def converter(self, base: str, target: str) -> Optional[Callable[[Decimal], Decimal]]:
+        """Return the one-argument converter of a fixed pair (``None`` if the rate is missing)."""
+
+        pair = self._pair(base, target)
+        return pair[1] if pair else None
+
+
+def _prepare(rate: Decimal, target: str) -> Tuple[Decimal, Callable[[Decimal], Decimal]]:
+    target_quantum, context = rounding_rule(target)
+    multiply, quantize = context.multiply, context.quantize
+    return rate, lambda amount: quantize(multiply(amount, rate), target_quantum)
+
+
+_TABLE_KEY: Optional[Tuple[int, int]] = None
+_TABLE: Optional[ConversionTable] = None
+
+
+def conversion_table(snapshot: RateSnapshot) -> ConversionTable:
+    """Return the :class:`ConversionTable` of *snapshot*, building it once per snapshot."""
+
+    global _TABLE_KEY, _TABLE
+    key = (snapshot.version, id(snapshot.rates))
+    if _TABLE is None or _TABLE_KEY != key:
+        _TABLE = ConversionTable(snapshot.rates)
+        _TABLE_KEY = key
+    return _TABLE
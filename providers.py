@@ -0,0 +1,361 @@
+"""Pluggable upstream rate providers with health tracking, hedging and fallback."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+from xml.etree.ElementTree import XMLPullParser
+
+from metrics import UPSTREAM_LATENCY, UPSTREAM_REQUESTS
+from rate_fetcher import RateFetcher
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """Raised when a provider (or every provider of a pool) cannot deliver rates."""
+
+
+class RateLimitedError(ProviderError):
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class ProviderQuotes:
+    """How many units of each currency one unit of ``reference`` buys, as reported by ``provider``."""
+
+    provider: str
+    reference: str
+    quotes: Dict[str, float]
+    fetched_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class ProviderHealth:
+    latency: float = 1.0
+    failures: int = 0
+    cooldown_until: float = 0.0
+    smoothing: float = 0.3
+    measured_at: float = 0.0
+
+    def healthy(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) >= self.cooldown_until
+
+    def expected_latency(self, now: float, half_life: float) -> float:
+        """Smoothed latency, halved for every *half_life* seconds it has gone unmeasured.
+
+        A provider that lost its place after one slow answer is no longer
+        queried, so its estimate would never recover; letting the estimate age
+        out puts it first again after a while and gives it a fresh measurement.
+        """
+
+        if not self.measured_at or half_life <= 0:
+            return self.latency
+        return self.latency * 0.5 ** (max(now - self.measured_at, 0.0) / half_life)
+
+    def record_success(self, latency: float) -> None:
+        self.latency += self.smoothing * (latency - self.latency)
+        self.measured_at = time.time()
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def record_cancelled(self, elapsed: float) -> None:
+        """Account for a request abandoned after *elapsed* seconds: it would have taken at least that long."""
+
+        if elapsed > self.latency:
+            self.latency += self.smoothing * (elapsed - self.latency)
+        self.measured_at = time.time()
+
+    def record_failure(self, *, max_cooldown: float = 600.0) -> None:
+        self.failures += 1
+        self.cooldown_until = time.time() + min(30.0 * 2 ** min(self.failures - 1, 16), max_cooldown)
+
+    def record_rate_limit(self, retry_after: Optional[float]) -> None:
+        self.failures += 1
+        self.cooldown_until = time.time() + (retry_after if retry_after is not None else 900.0)
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateProvider:
+    """Base class for a single upstream; subclasses implement :meth:`_fetch`."""
+
+    name = "provider"
+
+    def __init__(self) -> None:
+        self.health = ProviderHealth()
+
+    async def fetch(self, fetcher: RateFetcher) -> ProviderQuotes:
+        started = time.perf_counter()
+        try:
+            result = await self._fetch(fetcher)
+        except asyncio.CancelledError:
+            self.health.record_cancelled(self._record_outcome("cancelled", started))
+            raise
+        except RateLimitedError as exc:
+            self._record_outcome("rate_limited", started)
+            self.health.record_rate_limit(exc.retry_after)
+            raise
+        except Exception as exc:
+            if _status_code(exc) == 429:
+                self._record_outcome("rate_limited", started)
+                self.health.record_rate_limit(_retry_after(exc))
+                raise RateLimitedError(f"{self.name}: превышен лимит запросов", _retry_after(exc)) from exc
+            self._record_outcome("error", started)
+            self.health.record_failure()
+            raise
+        self.health.record_success(self._record_outcome("ok", started))
+        return result
+
+    def _record_outcome(self, outcome: str, started: float) -> float:
+        latency = time.perf_counter() - started
+        UPSTREAM_LATENCY.observe(latency, self.name)
+        UPSTREAM_REQUESTS.inc(self.name, outcome)
+        return latency
+
+    async def _fetch(self, fetcher: RateFetcher) -> ProviderQuotes:
+        raise NotImplementedError
+
+
+class ExchangeRateApiProvider(RateProvider):
+    """``/latest/<reference>`` of exchangerate-api.com (v6)."""
+
+    name = "exchangerate-api.com"
+
+    def __init__(
+        self,
+        api_key: str,
+        *,
+        reference: str = "USD",
+        base_url: str = "https://v6.exchangerate-api.com/v6",
+    ) -> None:
+        super().__init__()
+        self.reference = reference
+        self.url = f"{base_url.rstrip('/')}/{api_key}/latest/{reference}"
+
+    async def _fetch(self, fetcher: RateFetcher) -> ProviderQuotes:
+        data = await fetcher.fetch_json(self.url)
+        if data.get("result") == "error":
+            error_type = data.get("error-type", "unknown")
+            if error_type == "quota-reached":
+                raise RateLimitedError(f"{self.name}: квота исчерпана")
+            raise ProviderError(f"{self.name}: {error_type}")
+        quotes = {
+            code: float(value)
+            for code, value in data["conversion_rates"].items()
+            if isinstance(value, (int, float))
+        }
+        quotes.setdefault(self.reference, 1.0)
+        return ProviderQuotes(provider=self.name, reference=self.reference, quotes=quotes)
+
+
+class CbrDailyProvider(RateProvider):
+    """Daily official rates of the Central Bank of Russia (``XML_daily.asp``).
+
+    The document is parsed incrementally with :class:`XMLPullParser` while it
+    is being downloaded; every ``<Valute>`` element is discarded once read.
+    """
+
+    name = "cbr.ru"
+    reference = "RUB"
+
+    def __init__(self, *, url: str = "https://www.cbr.ru/scripts/XML_daily.asp") -> None:
+        super().__init__()
+        self.url = url
+
+    async def _fetch(self, fetcher: RateFetcher) -> ProviderQuotes:
+        parser = XMLPullParser(events=("end",))
+        quotes: Dict[str, float] = {self.reference: 1.0}
+        async for chunk in fetcher.stream_bytes(self.url):
+            parser.feed(chunk)
+            self._consume(parser, quotes)
+        parser.close()
+        self._consume(parser, quotes)
+        if len(quotes) == 1:
+            raise ProviderError(f"{self.name}: ответ не содержит курсов")
+        return ProviderQuotes(provider=self.name, reference=self.reference, quotes=quotes)
+
+    @staticmethod
+    def _consume(parser: XMLPullParser, quotes: Dict[str, float]) -> None:
+        for _, element in parser.read_events():
+            if element.tag != "Valute":
+                continue
+            code = element.findtext("CharCode")
+            nominal = element.findtext("Nominal")
+            value = element.findtext("Value")
+            element.clear()
+            if not code or not nominal or not value:
+                continue
+            try:
+                rub_per_unit = float(value.replace(",", ".")) / float(nominal.replace(",", "."))
+            except ValueError:
+                continue
+            if rub_per_unit > 0:
+                quotes[code.strip()] = 1.0 / rub_per_unit
+
+
+class ProviderPool:
+    """Query providers concurrently and return the first ``quorum`` answers.
+
+    Providers are ranked by health and smoothed latency.  The best one starts
+    immediately; if it has not answered within ``hedge_factor`` times its usual
+    latency (capped by ``max_hedge_delay``) the next one is raced against it,
+    and a failed or rate-limited provider is replaced by the next one at once.
+    When several answers are collected they are cross-checked on ``currencies``.
+
+    Providers differ in how many of ``currencies`` they cover (the CBR feed
+    has about forty).  Fuller providers rank first, and an answer settles the
+    race only if no running or healthy untried provider may cover more — so a
+    partial feed is a fallback for when the fuller ones fail, never the
+    primary source.  A provider's coverage is learned from its last answer.
+
+    A provider cancelled after losing a race is charged the time it had taken
+    so far, and a latency left unmeasured for ``latency_half_life`` seconds
+    counts half as much, so a provider demoted by one slow answer is tried
+    first again later instead of never being measured again.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[RateProvider],
+        *,
+        quorum: int = 1,
+        hedge_factor: float = 2.0,
+        max_hedge_delay: float = 3.0,
+        max_deviation: float = 0.02,
+        currencies: Sequence[str] = (),
+        latency_half_life: float = 600.0,
+    ) -> None:
+        self.providers = list(providers)
+        self.quorum = max(1, quorum)
+        self.hedge_factor = hedge_factor
+        self.max_hedge_delay = max_hedge_delay
+        self.max_deviation = max_deviation
+        self.currencies = tuple(currencies)
+        self.latency_half_life = latency_half_life
+        self._coverage: Dict[str, int] = {}
+
+    def coverage(self, provider: RateProvider) -> int:
+        """Currencies *provider* covered in its last answer; all of them until it has answered."""
+
+        return self._coverage.get(provider.name, len(self.currencies))
+
+    def _covered(self, result: ProviderQuotes) -> int:
+        return sum(code in result.quotes for code in self.currencies)
+
+    def ranked(self) -> List[RateProvider]:
+        now = time.time()
+        return sorted(
+            self.providers,
+            key=lambda provider: (
+                not provider.health.healthy(now),
+                -self.coverage(provider),
+                provider.health.expected_latency(now, self.latency_half_life),
+            ),
+        )
+
+    def _hedge_delay(self, running: Sequence[RateProvider]) -> float:
+        fastest = min(provider.health.latency for provider in running)
+        return min(self.hedge_factor * fastest, self.max_hedge_delay)
+
+    async def fetch(self, fetcher: RateFetcher) -> ProviderQuotes:
+        queue = self.ranked()
+        if not queue:
+            raise ProviderError("не настроено ни одного источника курсов")
+
+        loop = asyncio.get_running_loop()
+        pending: Dict[asyncio.Task, RateProvider] = {}
+        results: List[ProviderQuotes] = []
+        errors: List[str] = []
+        complete = 0
+
+        def launch() -> None:
+            provider = queue.pop(0)
+            pending[loop.create_task(provider.fetch(fetcher))] = provider
+
+        def settles(result: ProviderQuotes) -> bool:
+            covered = self._coverage[result.provider]
+            now = time.time()
+            return not any(
+                self.coverage(provider) > covered
+                for provider in [*pending.values(), *(p for p in queue if p.health.healthy(now))]
+            )
+
+        launch()
+        try:
+            while pending and complete < self.quorum:
+                timeout = self._hedge_delay(list(pending.values())) if queue else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(f"{provider.name}: {task.exception()}")
+                    else:
+                        result = task.result()
+                        self._coverage[result.provider] = self._covered(result)
+                        results.append(result)
+                complete = sum(settles(result) for result in results)
+                while queue and len(pending) + complete < self.quorum:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if not results:
+            raise ProviderError("; ".join(errors) or "источники курсов не ответили")
+        results.sort(key=lambda result: -self._coverage[result.provider])
+        covered = self._coverage[results[0].provider]
+        if covered < max(self._coverage.values()):
+            logger.warning(
+                "Курсы получены только от %s: %d из %d валют",
+                results[0].provider,
+                covered,
+                len(self.currencies),
+                extra={"provider": results[0].provider},
+            )
+        for issue in self._disagreements(results):
+            logger.warning("Источники расходятся: %s", issue)
+        return results[0]
+
+    def _disagreements(self, results: Sequence[ProviderQuotes]) -> List[str]:
+        issues: List[str] = []
+        primary = results[0]
+        for other in results[1:]:
+            common = [
+                code
+                for code in self.currencies
+                if code in primary.quotes and code in other.quotes
+            ]
+            if len(common) < 2:
+                continue
+            pivot = common[0]
+            for code in common[1:]:
+                mine = primary.quotes[code] / primary.quotes[pivot]
+                theirs = other.quotes[code] / other.quotes[pivot]
+                deviation = abs(mine / theirs - 1.0)
+                if deviation > self.max_deviation:
+                    issues.append(
+                        f"{pivot}/{code}: {primary.provider} и {other.provider} отличаются на {deviation:.2%}"
+                    )
+        return issues
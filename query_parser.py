@@ -0,0 +1,75 @@
+"""Free-form conversion queries such as ``100 usd eur`` or ``5k rub→cny``."""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from money import to_decimal
+
+_TOKEN_RE = re.compile(
+    r"(?P<amount>\d+(?:[.,]\d+)?)(?!\d)(?:\s*(?P<suffix>[kкmм])(?![a-zа-яё]))?"
+    r"|(?P<word>[a-zа-яё]+|[$€¥₽])",
+    re.IGNORECASE,
+)
+
+_SUFFIXES = {"k": Decimal(1000), "к": Decimal(1000), "m": Decimal(1000000), "м": Decimal(1000000)}
+
+SYMBOL_ALIASES: Dict[str, str] = {
+    "$": "USD",
+    "€": "EUR",
+    "¥": "CNY",
+    "₽": "RUB",
+    "руб": "RUB",
+    "рубль": "RUB",
+    "рублей": "RUB",
+    "доллар": "USD",
+    "долларов": "USD",
+    "евро": "EUR",
+    "юань": "CNY",
+    "юаней": "CNY",
+}
+
+
+@dataclass(frozen=True)
+class ConversionQuery:
+    amount: Decimal
+    base: str
+    target: Optional[str]
+
+
+def parse_query(text: str, currencies: Iterable[str]) -> Optional[ConversionQuery]:
+    """Extract amount, base and (optional) target currency from *text*.
+
+    Words that are neither currencies nor aliases ("to", "в", "->" …) are
+    ignored; the amount defaults to 1.  Returns ``None`` without a base currency.
+    """
+
+    known = currencies if isinstance(currencies, (set, frozenset)) else set(currencies)
+    amount: Optional[Decimal] = None
+    codes = []
+    for match in _TOKEN_RE.finditer(text):
+        if match.group("amount") is not None:
+            if amount is None:
+                amount = to_decimal(match.group("amount").replace(",", "."))
+                suffix = match.group("suffix")
+                if amount is not None and suffix:
+                    amount *= _SUFFIXES[suffix.lower()]
+            continue
+        word = match.group("word").lower()
+        code = SYMBOL_ALIASES.get(word, word.upper())
+        if code in known:
+            codes.append(code)
+
+    if not codes:
+        return None
+    base = codes[0]
+    target = next((code for code in codes[1:] if code != base), None)
+    return ConversionQuery(amount=Decimal(1) if amount is None else amount, base=base, target=target)
+
+
+def query_targets(query: ConversionQuery, currencies: Iterable[str]) -> Tuple[str, ...]:
+    if query.target is not None:
+        return (query.target,)
+    return tuple(code for code in currencies if code != query.base)
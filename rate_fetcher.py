@@ -0,0 +1,54 @@
+"""Non-blocking HTTP access to the upstream rate APIs."""
+from __future__ import annotations
+
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+
+
+class RateFetcher:
+    """Fetch JSON documents concurrently over one pooled keep-alive session.
+
+    ``request_timeout`` bounds every single request; the caller bounds a whole
+    refresh.  ``httpx`` ships with python-telegram-bot, so the bot needs no
+    other HTTP client.
+    """
+
+    def __init__(
+        self,
+        *,
+        request_timeout: float = 5.0,
+        max_connections: int = 10,
+    ) -> None:
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.request_timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def fetch_json(self, url: str) -> Any:
+        response = await self._get_client().get(url)
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_bytes(self, url: str, *, chunk_size: int = 16384) -> AsyncIterator[bytes]:
+        """Yield the response body in chunks so large documents can be parsed incrementally."""
+
+        async with self._get_client().stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,247 @@
+"""Append-only SQLite history of fetched rates with hourly and daily rollups."""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from rates import RateSnapshot
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    base TEXT NOT NULL,
+    target TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    rate REAL NOT NULL,
+    PRIMARY KEY (base, target, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hourly (
+    base TEXT NOT NULL,
+    target TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    sum REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (base, target, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily (
+    base TEXT NOT NULL,
+    target TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    sum REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (base, target, ts)
+) WITHOUT ROWID;
+"""
+
+_ROLLUP_UPSERT = """
+INSERT INTO {table} (base, target, ts, min, max, sum, count) VALUES (?, ?, ?, ?, ?, ?, 1)
+ON CONFLICT (base, target, ts) DO UPDATE SET
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    sum = sum + excluded.sum,
+    count = count + 1
+"""
+
+# (table, min/max/sum/count aggregate expressions)
+_RAW = ("samples", "MIN(rate)", "MAX(rate)", "SUM(rate)", "COUNT(*)")
+_HOURLY = ("hourly", "MIN(min)", "MAX(max)", "SUM(sum)", "SUM(count)")
+_DAILY = ("daily", "MIN(min)", "MAX(max)", "SUM(sum)", "SUM(count)")
+
+
+@dataclass(frozen=True)
+class HistoryStats:
+    base: str
+    target: str
+    since: int
+    until: int
+    minimum: float
+    maximum: float
+    mean: float
+    samples: int
+    series: List[float]
+
+    def sparkline(self) -> str:
+        return sparkline(self.series)
+
+
+def sparkline(values: List[float]) -> str:
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[round((value - low) * scale)] for value in values)
+
+
+class RateHistory:
+    """Minute-level samples plus incrementally maintained hourly/daily rollups.
+
+    Raw samples are kept for ``raw_retention`` seconds and hourly buckets for
+    ``hourly_retention`` seconds; daily buckets are kept forever, so disk use
+    grows by one row per pair and day once the retention windows are full.
+    All lookups go through the ``(base, target, ts)`` primary keys.
+
+    When ``currencies`` is given only pairs between those currencies are
+    recorded; storing every cross rate of ~160 currencies each minute would
+    write tens of thousands of rows per refresh.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        raw_retention: float = 7 * DAY,
+        hourly_retention: float = 180 * DAY,
+        prune_interval: float = HOUR,
+        currencies: Optional[Sequence[str]] = None,
+    ) -> None:
+        self.path = path
+        self.currencies = tuple(currencies) if currencies is not None else None
+        self.raw_retention = raw_retention
+        self.hourly_retention = hourly_retention
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_ts = 0
+        self._last_prune = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            row = conn.execute("SELECT MAX(ts) FROM samples").fetchone()
+            self._last_ts = row[0] or 0
+            self._conn = conn
+        return self._conn
+
+    def tracks(self, base: str, target: str) -> bool:
+        return self.currencies is None or (base in self.currencies and target in self.currencies)
+
+    def record(self, snapshot: RateSnapshot) -> int:
+        """Append every available (tracked) pair of *snapshot*; returns the number of stored rates."""
+
+        ts = int(snapshot.fetched_at)
+        rates = snapshot.rates
+        if self.currencies is None:
+            rows = [
+                (base, target, rate)
+                for base, row in rates.items()
+                for target, rate in row.items()
+                if rate is not None
+            ]
+        else:
+            rows = [
+                (base, target, rate)
+                for base in self.currencies
+                for target in self.currencies
+                if (rate := rates.get(base, {}).get(target)) is not None
+            ]
+        with self._lock:
+            conn = self._connect()
+            if ts <= self._last_ts or not rows:
+                return 0
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO samples (base, target, ts, rate) VALUES (?, ?, ?, ?)",
+                    [(base, target, ts, rate) for base, target, rate in rows],
+                )
+                for table, bucket in (("hourly", HOUR), ("daily", DAY)):
+                    bucket_ts = ts - ts % bucket
+                    conn.executemany(
+                        _ROLLUP_UPSERT.format(table=table),
+                        [(base, target, bucket_ts, rate, rate, rate) for base, target, rate in rows],
+                    )
+            self._last_ts = ts
+            if time.time() - self._last_prune >= self.prune_interval:
+                self._prune(conn, {(base, target) for base, target, _ in rows})
+        return len(rows)
+
+    def _prune(self, conn: sqlite3.Connection, pairs: set) -> None:
+        now = time.time()
+        raw_cutoff = int(now - self.raw_retention)
+        hourly_cutoff = int(now - self.hourly_retention)
+        with conn:
+            for base, target in pairs:
+                conn.execute(
+                    "DELETE FROM samples WHERE base = ? AND target = ? AND ts < ?",
+                    (base, target, raw_cutoff),
+                )
+                conn.execute(
+                    "DELETE FROM hourly WHERE base = ? AND target = ? AND ts < ?",
+                    (base, target, hourly_cutoff),
+                )
+        self._last_prune = now
+
+    def _pick_source(self, since: int, until: int) -> Tuple[str, str, str, str, str]:
+        span = until - since
+        now = time.time()
+        if span <= 2 * DAY and since >= now - self.raw_retention:
+            return _RAW
+        if span <= 60 * DAY and since >= now - self.hourly_retention:
+            return _HOURLY
+        return _DAILY
+
+    def query(
+        self,
+        base: str,
+        target: str,
+        since: int,
+        until: Optional[int] = None,
+        *,
+        points: int = 24,
+    ) -> Optional[HistoryStats]:
+        """Aggregate ``base → target`` over ``[since, until]``; ``None`` if there is no data."""
+
+        until = int(time.time()) if until is None else until
+        table, min_expr, max_expr, sum_expr, count_expr = self._pick_source(since, until)
+        where = f"FROM {table} WHERE base = ? AND target = ? AND ts BETWEEN ? AND ?"
+        params = (base, target, since, until)
+        width = max(1, (until - since + points - 1) // points)
+
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(
+                f"SELECT {min_expr}, {max_expr}, {sum_expr}, {count_expr} {where}", params
+            ).fetchone()
+            if not total or not total[3]:
+                return None
+            series = conn.execute(
+                f"SELECT (ts - ?) / ? AS bucket, {sum_expr} / {count_expr} {where} "
+                "GROUP BY bucket ORDER BY bucket",
+                (since, width, *params),
+            ).fetchall()
+
+        minimum, maximum, total_sum, count = total
+        return HistoryStats(
+            base=base,
+            target=target,
+            since=since,
+            until=until,
+            minimum=minimum,
+            maximum=maximum,
+            mean=total_sum / count,
+            samples=count,
+            series=[value for _, value in series],
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,315 @@
+"""Shared, versioned exchange-rate snapshot used by every chat of the bot."""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+RatesMatrix = Dict[str, Dict[str, Optional[float]]]
+# A fetcher returns the rate matrix together with the name of the source that produced it.
+Fetcher = Callable[[], Awaitable[Tuple[RatesMatrix, str]]]
+RefreshListener = Callable[["RateSnapshot"], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """Immutable rate matrix together with its version and fetch time."""
+
+    rates: RatesMatrix
+    version: int
+    fetched_at: float = field(default_factory=time.time)
+    source: str = ""
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (time.time() if now is None else now) - self.fetched_at
+
+    def rate(self, base: str, target: str) -> Optional[float]:
+        return self.rates.get(base, {}).get(target)
+
+
+def build_cross_matrix(quotes: Mapping[str, float], currencies: Sequence[str]) -> RatesMatrix:
+    """Build the full N×N cross-rate matrix from a single base response.
+
+    ``quotes`` is the ``conversion_rates`` table of one upstream response, i.e.
+    how many units of each currency one unit of the response base buys.  The
+    cross rate ``base → target`` is then ``quotes[target] / quotes[base]``.
+    Missing, zero or non-finite quotes yield ``None`` for every affected pair.
+    """
+
+    values = array("d", (_valid_quote(quotes.get(code)) for code in currencies))
+    matrix: RatesMatrix = {}
+    for i, base in enumerate(currencies):
+        base_value = values[i]
+        if base_value == 0.0:
+            matrix[base] = {target: None for target in currencies if target != base}
+            continue
+        inverse = 1.0 / base_value
+        matrix[base] = {
+            target: (values[j] * inverse if values[j] else None)
+            for j, target in enumerate(currencies)
+            if j != i
+        }
+    return matrix
+
+
+def check_drift(
+    previous: Optional[RatesMatrix],
+    quotes: Mapping[str, float],
+    reference: str,
+    *,
+    tolerance: float = 0.1,
+) -> List[str]:
+    """Return human-readable descriptions of quotes that jumped since the *previous* matrix.
+
+    Cross rates are all derived from one response, so they always agree with
+    each other; a bad upstream quote can only show as a jump against the last
+    snapshot.  Each currency is compared once through ``reference`` (O(N)).
+    """
+
+    row = (previous or {}).get(reference)
+    if not row:
+        return []
+    issues: List[str] = []
+    for code, old in row.items():
+        new = _valid_quote(quotes.get(code))
+        if not old or not new:
+            continue
+        drift = abs(new / old - 1.0)
+        if drift > tolerance:
+            issues.append(f"{reference}/{code}: {old:.6g} → {new:.6g} ({drift:.1%})")
+    return issues
+
+
+def save_snapshot(path: Path, snapshot: RateSnapshot) -> None:
+    """Atomically write *snapshot* to *path* as compact JSON."""
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "version": snapshot.version,
+        "fetched_at": snapshot.fetched_at,
+        "source": snapshot.source,
+        "rates": snapshot.rates,
+    }
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False, separators=(",", ":"))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def load_snapshot(path: Path) -> Optional[RateSnapshot]:
+    """Read a snapshot written by :func:`save_snapshot`; ``None`` if absent or unreadable."""
+
+    try:
+        with path.open(encoding="utf-8") as handle:
+            payload = json.load(handle)
+        return RateSnapshot(
+            rates=payload["rates"],
+            version=int(payload["version"]),
+            fetched_at=float(payload["fetched_at"]),
+            source=str(payload.get("source", "")),
+        )
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        logger.warning("Не удалось прочитать сохранённые курсы из %s: %s", path, exc)
+        return None
+
+
+def _valid_quote(value: object) -> float:
+    if isinstance(value, (int, float)) and math.isfinite(value) and value > 0:
+        return float(value)
+    return 0.0
+
+
+def _has_any_rate(rates: RatesMatrix) -> bool:
+    return any(value is not None for row in rates.values() for value in row.values())
+
+
+class RateCache:
+    """Process-wide rate cache with TTL, stale-while-revalidate and single-flight refresh.
+
+    * ``get()`` returns the current snapshot if it is younger than ``ttl``.
+    * Between ``ttl`` and ``ttl + stale_ttl`` the stale snapshot is returned
+      immediately while a refresh runs in the background.
+    * Any number of concurrent misses or forced refreshes share one upstream call.
+    * After ``failure_threshold`` failed refreshes in a row the circuit opens for
+      ``circuit_cooldown`` seconds and the last good snapshot is served as is.
+    """
+
+    def __init__(
+        self,
+        fetcher: Fetcher,
+        *,
+        ttl: float = 300.0,
+        stale_ttl: float = 3600.0,
+        min_refresh_interval: float = 30.0,
+        failure_threshold: int = 3,
+        circuit_cooldown: float = 300.0,
+    ) -> None:
+        self._fetcher = fetcher
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.failure_threshold = failure_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self._snapshot: Optional[RateSnapshot] = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._version = 0
+        self.consecutive_failures = 0
+        self.last_attempt_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self.circuit_open_until = 0.0
+        self._listeners: List[RefreshListener] = []
+
+    @property
+    def snapshot(self) -> Optional[RateSnapshot]:
+        """Current snapshot without touching the upstream (``None`` before the first fetch)."""
+
+        return self._snapshot
+
+    def restore(self, snapshot: RateSnapshot) -> None:
+        """Seed the cache with a previously persisted snapshot, e.g. at startup."""
+
+        self._snapshot = snapshot
+        self._version = max(self._version, snapshot.version)
+
+    def add_listener(self, listener: RefreshListener) -> None:
+        """Call *listener* with every new snapshot after a successful refresh."""
+
+        self._listeners.append(listener)
+
+    def circuit_open(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) < self.circuit_open_until
+
+    def status(self) -> RefreshStatus:
+        """Describe refresh timing and staleness without touching the upstream."""
+
+        snapshot = self._snapshot
+        now = time.time()
+        return RefreshStatus(
+            version=snapshot.version if snapshot else 0,
+            age=snapshot.age(now) if snapshot else None,
+            stale=snapshot is None or snapshot.age(now) > self.ttl,
+            last_attempt_at=self.last_attempt_at,
+            last_success_at=self.last_success_at,
+            consecutive_failures=self.consecutive_failures,
+            circuit_open=self.circuit_open(now),
+        )
+
+    async def get(self) -> Optional[RateSnapshot]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            CACHE_LOOKUPS.inc("miss")
+            return await self.refresh()
+
+        age = snapshot.age()
+        if age <= self.ttl:
+            CACHE_LOOKUPS.inc("hit")
+            return snapshot
+        if age <= self.ttl + self.stale_ttl:
+            CACHE_LOOKUPS.inc("stale")
+            self._start_refresh()
+            return snapshot
+        CACHE_LOOKUPS.inc("miss")
+        return await self.refresh()
+
+    async def refresh(self, *, force: bool = False) -> Optional[RateSnapshot]:
+        """Refresh the snapshot, joining an in-flight refresh if there is one.
+
+        A forced refresh is ignored while the snapshot is younger than
+        ``min_refresh_interval`` so repeated button presses cannot hammer the API.
+        """
+
+        snapshot = self._snapshot
+        if force and snapshot is not None and snapshot.age() < self.min_refresh_interval:
+            return snapshot
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.get_running_loop().create_task(self._do_refresh())
+        return self._inflight
+
+    async def _do_refresh(self) -> Optional[RateSnapshot]:
+        if self._snapshot is not None and self.circuit_open():
+            return self._snapshot
+
+        self.last_attempt_at = time.time()
+        try:
+            rates, source = await self._fetcher()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Не удалось обновить курсы валют: %s", exc)
+            return self._record_failure()
+
+        if not _has_any_rate(rates):
+            logger.warning("Источник не вернул ни одного курса, оставляем предыдущие данные.")
+            return self._record_failure()
+
+        self.consecutive_failures = 0
+        self.circuit_open_until = 0.0
+        self.last_success_at = time.time()
+        self._version += 1
+        self._snapshot = RateSnapshot(rates=rates, version=self._version, source=source)
+        for listener in self._listeners:
+            try:
+                await listener(self._snapshot)
+            except Exception as exc:  # noqa: BLE001
+                logger.exception("Ошибка обработчика обновления курсов: %s", exc)
+        return self._snapshot
+
+    def _record_failure(self) -> Optional[RateSnapshot]:
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.circuit_open_until = time.time() + self.circuit_cooldown
+            logger.error(
+                "Источник курсов недоступен %d раз подряд, пауза %.0f с.",
+                self.consecutive_failures,
+                self.circuit_cooldown,
+                extra={"consecutive_failures": self.consecutive_failures},
+            )
+        return self._snapshot
+
+
+@dataclass(frozen=True)
+class RefreshStatus:
+    version: int
+    age: Optional[float]
+    stale: bool
+    last_attempt_at: Optional[float]
+    last_success_at: Optional[float]
+    consecutive_failures: int
+    circuit_open: bool
+
+
+@dataclass(frozen=True)
+class RefreshPolicy:
+    """Timing of the background refresh: fixed interval, jitter and exponential backoff."""
+
+    interval: float = 60.0
+    jitter: float = 5.0
+    max_backoff: float = 900.0
+
+    def next_delay(self, failures: int = 0) -> float:
+        delay = self.interval
+        if failures:
+            delay = min(self.interval * (2 ** min(failures, 16)), self.max_backoff)
+        return delay + random.uniform(0.0, self.jitter)
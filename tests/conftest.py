@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# exchange_bot reads its configuration at import time.
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("API_KEY", "test")
@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+import pytest
+
+from batch import iter_csv_amounts, parse_amounts
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("1 234,56", ["1234.56"]),
+        ("12 000", ["12000"]),
+        ("12 000", ["12000"]),
+        ("1'000.5", ["1000.5"]),
+        ("1,5", ["1.5"]),
+        ("100, 200, 300", ["100", "200", "300"]),
+        ("100\n2 500,75\n\n3", ["100", "2500.75", "3"]),
+        ("10;20\t30", ["10", "20", "30"]),
+        ("1 000 000", ["1000000"]),
+        ("1\u00a0234\u00a0567", ["1234567"]),
+        ("100 5", ["100", "5"]),
+        ("100 200 300", ["100", "200", "300"]),
+        ("12 00", ["12", "0"]),
+    ],
+)
+def test_parse_amounts(text, expected):
+    assert parse_amounts(text) == [Decimal(value) for value in expected]
+
+
+@pytest.mark.parametrize("text", ["", "abc", "100, abc", "100 abc", "1'00"])
+def test_parse_amounts_rejects_garbage(text):
+    with pytest.raises(ValueError):
+        parse_amounts(text)
+
+
+def test_csv_skips_header_and_text_rows():
+    lines = ["name;amount\n", "a;1 500,5\n", "b;n/a\n", "c;2\n"]
+    assert list(iter_csv_amounts(lines)) == [(2, Decimal("1500.5")), (4, Decimal("2"))]
+
+
+def test_csv_cell_keeps_thousands_groups_and_rejects_loose_spaces():
+    lines = ["amount\n", "100 200 300\n", "100 5\n"]
+    assert list(iter_csv_amounts(lines)) == [(2, Decimal("100200300"))]
@@ -0,0 +1,47 @@
+from bot_cli import _metrics_urls, merge_samples, summarize_metrics
+
+
+def test_metrics_urls_cover_every_worker(monkeypatch):
+    monkeypatch.delenv("METRICS_URL", raising=False)
+    monkeypatch.setenv("METRICS_LISTEN", "0.0.0.0")
+    monkeypatch.setenv("METRICS_PORT", "9000")
+    monkeypatch.setenv("WORKERS", "2")
+    assert [url for _, url in _metrics_urls()] == [
+        "http://127.0.0.1:9000/metrics",
+        "http://127.0.0.1:9001/metrics",
+        "http://127.0.0.1:9002/metrics",
+    ]
+    monkeypatch.setenv("WORKERS", "0")
+    assert len(_metrics_urls()) == 1
+
+
+def test_merge_sums_counters_and_keeps_the_leaders_rates_gauges():
+    leader = [
+        ("exchange_bot_rates_version", {}, 5.0),
+        ("exchange_bot_rates_age_seconds", {}, 3.0),
+        ("exchange_bot_update_queue_depth", {}, 1.0),
+    ]
+    worker = [
+        ("exchange_bot_rates_version", {}, 4.0),
+        ("exchange_bot_rates_age_seconds", {}, 70.0),
+        ("exchange_bot_update_queue_depth", {}, 2.0),
+        ("exchange_bot_handler_duration_seconds_bucket", {"handler": "start", "le": "+Inf"}, 3.0),
+        ("exchange_bot_alerts_active", {}, 7.0),
+    ]
+    merged = {
+        (name, tuple(sorted(labels.items()))): value
+        for name, labels, value in merge_samples([leader, worker, worker])
+    }
+
+    assert merged[("exchange_bot_rates_version", ())] == 5.0
+    assert merged[("exchange_bot_rates_age_seconds", ())] == 3.0
+    assert merged[("exchange_bot_update_queue_depth", ())] == 5.0
+    assert merged[("exchange_bot_alerts_active", ())] == 14.0
+    assert merged[("exchange_bot_handler_duration_seconds_bucket", (("handler", "start"), ("le", "+Inf")))] == 6.0
+    assert any("start" in line for line in summarize_metrics(merge_samples([leader, worker])))
+
+
+def test_merge_without_the_leader_drops_its_gauges():
+    worker = [("exchange_bot_rates_version", {}, 4.0), ("exchange_bot_alerts_active", {}, 2.0)]
+    merged = merge_samples([[], worker])
+    assert merged == [("exchange_bot_alerts_active", {}, 2.0)]
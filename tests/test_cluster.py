@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from cluster import SharedSnapshot
+from rates import RateSnapshot, build_cross_matrix
+
+
+def _snapshot(currencies, version, usd_rub):
+    quotes = {code: 1.0 + index for index, code in enumerate(currencies)}
+    quotes.update(USD=1.0, RUB=usd_rub)
+    return RateSnapshot(build_cross_matrix(quotes, currencies), version=version)
+
+
+def test_shared_snapshot_round_trip(tmp_path):
+    currencies = ["USD", "EUR", "RUB"]
+    shared = SharedSnapshot.create(tmp_path / "rates.mmap", currencies)
+    reader = SharedSnapshot.open(tmp_path / "rates.mmap")
+    try:
+        assert reader.version() == 0
+        shared.publish(_snapshot(currencies, 7, 92.5))
+        snapshot = reader.read()
+        assert reader.version() == snapshot.version == 7
+        assert snapshot.rate("USD", "RUB") == 92.5
+        assert snapshot.rate("RUB", "USD") == 1 / 92.5
+    finally:
+        reader.close()
+        shared.close()
+
+
+def test_worker_refresh_serves_the_leaders_new_snapshot(tmp_path, monkeypatch):
+    import exchange_bot
+
+    currencies = list(exchange_bot.CURRENCIES)
+    shared = SharedSnapshot.create(tmp_path / "rates.mmap", currencies)
+    old, new = _snapshot(currencies, 1, 90.0), _snapshot(currencies, 2, 95.0)
+    shared.publish(old)
+    monkeypatch.setattr(exchange_bot.RATE_CACHE, "_snapshot", old)
+    monkeypatch.setattr(exchange_bot.RATE_CACHE, "_version", old.version)
+
+    class Leader:
+        calls = 0
+
+        async def call(self, message, timeout):
+            # The leader refreshes, publishes and only then replies.
+            Leader.calls += 1
+            shared.publish(new)
+            return {"version": new.version}
+
+    monkeypatch.setattr(exchange_bot, "LEADER_LINK", Leader())
+    application = SimpleNamespace(bot_data={"shared_rates": shared})
+    try:
+        cached = asyncio.run(exchange_bot.ensure_rates(application))
+        refreshed = asyncio.run(exchange_bot.ensure_rates(application, force_refresh=True))
+    finally:
+        shared.close()
+
+    assert cached is old
+    assert Leader.calls == 1
+    assert refreshed.version == 2
+    assert refreshed.rate("USD", "RUB") == 95.0
+    assert exchange_bot.RATE_CACHE.snapshot.version == 2
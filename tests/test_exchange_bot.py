@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import exchange_bot
+
+
+@pytest.mark.parametrize(
+    "text, seconds",
+    [("30d", 30 * 86400), ("12H", 12 * 3600), ("10y", 10 * 365 * 86400), ("3650d", 3650 * 86400)],
+)
+def test_parse_history_period(text, seconds):
+    assert exchange_bot.parse_history_period(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["0d", "11y", "9999m", "12345d", "99999999999999999999y", "d", "5x"])
+def test_parse_history_period_rejects_out_of_range(text):
+    assert exchange_bot.parse_history_period(text) is None
+
+
+def test_history_replies_with_usage_for_a_huge_period():
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(message=SimpleNamespace(reply_text=reply_text))
+    context = SimpleNamespace(args=["USD", "RUB", "99999999999999999999y"])
+    asyncio.run(exchange_bot.history(update, context))
+
+    assert len(replies) == 1
+    assert replies[0].startswith("Использование: /history")
+
+
+def test_refresh_job_reschedules_after_an_unexpected_error(monkeypatch):
+    scheduled = []
+
+    async def broken_refresh(*args, **kwargs):
+        raise RuntimeError("persistence failed")
+
+    monkeypatch.setattr(exchange_bot.RATE_CACHE, "refresh", broken_refresh)
+    monkeypatch.setattr(exchange_bot.RATE_CACHE, "consecutive_failures", 2)
+    job_queue = SimpleNamespace(run_once=lambda callback, delay, name: scheduled.append((callback, delay)))
+    asyncio.run(exchange_bot.refresh_rates_job(SimpleNamespace(job_queue=job_queue)))
+
+    policy = exchange_bot.REFRESH_POLICY
+    assert [callback for callback, _ in scheduled] == [exchange_bot.refresh_rates_job]
+    # Backed off as after a third failure in a row.
+    assert scheduled[0][1] >= min(policy.interval * 2**3, policy.max_backoff)
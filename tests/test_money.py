@@ -0,0 +1,89 @@
+import random
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+from hypothesis import given, strategies
+
+from money import MAX_DIGITS, ConversionTable, format_money, minor_units, to_decimal
+
+TARGETS = ("USD", "JPY", "KWD", "CLF")  # 2, 0, 3 and 4 minor units
+
+
+def _reference(amount: Decimal, rate: float, target: str) -> Fraction:
+    """Exact product of the amount and the published rate, rounded half away from zero."""
+
+    exact = Fraction(amount) * Fraction(repr(rate))
+    scale = 10 ** minor_units(target)
+    units, rest = divmod(abs(exact) * scale, 1)
+    if rest >= Fraction(1, 2):
+        units += 1
+    return (units if exact >= 0 else -units) / Fraction(scale)
+
+
+def _random_amount(rng: random.Random) -> Decimal:
+    digits = rng.randint(1, MAX_DIGITS)
+    mantissa = rng.randrange(10 ** (digits - 1), 10**digits)
+    exponent = rng.randint(-min(digits, 12), max(0, 17 - digits))
+    sign = "-" if rng.random() < 0.1 else ""
+    return Decimal(f"{sign}{mantissa}E{exponent}")
+
+
+def _random_rate(rng: random.Random) -> float:
+    return rng.choice([rng.uniform(1e-6, 1e-2), rng.uniform(0.01, 100.0), rng.uniform(100.0, 1e6)])
+
+
+def _check(amount: Decimal, rate: float, target: str) -> None:
+    table = ConversionTable({"XXX": {target: rate}})
+    result = table.convert(amount, "XXX", target)
+    assert result == table.converter("XXX", target)(amount)
+    assert Fraction(result) == _reference(amount, rate, target)
+    # Already rounded: the display form has exactly the target's minor units.
+    assert str(result) == format_money(result, target)
+    assert -result.as_tuple().exponent == minor_units(target)
+
+
+def test_conversion_matches_exact_fraction_arithmetic():
+    rng = random.Random(20240601)
+    for _ in range(5000):
+        _check(_random_amount(rng), _random_rate(rng), rng.choice(TARGETS))
+
+
+@pytest.mark.parametrize(
+    "amount, rate, target, expected",
+    [
+        ("0.5", 1.0, "JPY", "1"),
+        ("2.5", 1.0, "JPY", "3"),
+        ("-2.5", 1.0, "JPY", "-3"),
+        ("0.005", 1.0, "USD", "0.01"),
+        ("1", 0.1, "USD", "0.10"),
+        ("3", 0.1, "USD", "0.30"),  # 0.30000000000000004 in binary floating point
+        ("1.0005", 1.0, "KWD", "1.001"),
+    ],
+)
+def test_half_up_boundaries(amount, rate, target, expected):
+    assert str(ConversionTable({"XXX": {target: rate}}).convert(Decimal(amount), "XXX", target)) == expected
+
+
+def test_missing_rate_has_no_converter():
+    table = ConversionTable({"XXX": {"USD": None}})
+    assert table.converter("XXX", "USD") is None
+    assert table.convert(Decimal(1), "XXX", "EUR") is None
+
+
+def test_to_decimal_limits():
+    assert to_decimal("1e18") is None
+    assert to_decimal("nan") is None
+    assert to_decimal("1" * (MAX_DIGITS + 1)) is None
+    assert to_decimal("12.50") == Decimal("12.5")
+
+
+@given(
+    strategies.decimals(
+        min_value=Decimal("-1e17"), max_value=Decimal("1e17"), allow_nan=False, allow_infinity=False, places=6
+    ),
+    strategies.floats(min_value=1e-6, max_value=1e6, allow_nan=False, allow_infinity=False),
+    strategies.sampled_from(TARGETS),
+)
+def test_conversion_property_with_hypothesis(amount, rate, target):
+    _check(amount, rate, target)
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+from providers import (
+    CbrDailyProvider,
+    ExchangeRateApiProvider,
+    ProviderError,
+    ProviderPool,
+    ProviderQuotes,
+    RateLimitedError,
+    RateProvider,
+)
+from rate_fetcher import RateFetcher
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class FakeProvider(RateProvider):
+    def __init__(self, name, delays, quotes=None):
+        super().__init__()
+        self.name = name
+        self.delays = list(delays)
+        self.quotes = quotes or {"USD": 1.0, "EUR": 0.9}
+        self.calls = 0
+
+    async def _fetch(self, fetcher):
+        self.calls += 1
+        await asyncio.sleep(self.delays.pop(0) if self.delays else 0.0)
+        return ProviderQuotes(provider=self.name, reference="USD", quotes=dict(self.quotes))
+
+
+def _fetch(pool):
+    return asyncio.run(pool.fetch(fetcher=None))
+
+
+def test_hedge_loser_is_charged_and_recovers_first_place():
+    primary = FakeProvider("primary", [0.3, 0.01, 0.01])
+    backup = FakeProvider("backup", [0.05, 0.05])
+    primary.health.latency = 0.01
+    backup.health.latency = 0.05
+    pool = ProviderPool([primary, backup], hedge_factor=2.0, max_hedge_delay=0.05, latency_half_life=60.0)
+
+    assert _fetch(pool).provider == "backup"
+    # The cancelled primary is charged for the time it spent.
+    assert primary.health.latency > 0.01
+    # Say a few more slow answers pushed it well behind the backup.
+    primary.health.latency = 1.0
+    assert pool.ranked()[0] is backup
+
+    # Once its estimate has aged, the primary is tried first again and re-measured.
+    primary.health.measured_at = time.time() - 600
+    assert pool.ranked()[0] is primary
+    assert _fetch(pool).provider == "primary"
+    assert primary.calls == 2
+
+
+def test_failed_provider_falls_back_to_next():
+    class Broken(FakeProvider):
+        async def _fetch(self, fetcher):
+            raise ConnectionError("down")
+
+    broken = Broken("broken", [])
+    broken.health.latency = 0.01
+    backup = FakeProvider("backup", [0.0])
+    pool = ProviderPool([broken, backup])
+
+    assert _fetch(pool).provider == "backup"
+    assert not broken.health.healthy()
+    assert pool.ranked()[0] is backup
+
+
+CURRENCIES = ("USD", "EUR", "RUB", "CNY", "JPY")
+FULL = {code: 1.0 + index for index, code in enumerate(CURRENCIES)}
+PARTIAL = {code: FULL[code] for code in ("USD", "RUB")}
+
+
+def test_partial_provider_never_wins_over_a_fuller_one():
+    full = FakeProvider("full", [0.2, 0.2], FULL)
+    partial = FakeProvider("partial", [0.0, 0.0], PARTIAL)
+    partial.health.latency = 0.001
+    pool = ProviderPool([partial, full], max_hedge_delay=0.01, currencies=CURRENCIES)
+
+    # The partial feed answers first, but the fuller provider is still running.
+    assert _fetch(pool).provider == "full"
+    assert pool.coverage(partial) == 2
+    assert pool.ranked()[0] is full
+    assert _fetch(pool).provider == "full"
+
+
+def test_partial_provider_is_the_fallback():
+    class Broken(FakeProvider):
+        async def _fetch(self, fetcher):
+            raise ConnectionError("down")
+
+    full = Broken("full", [], FULL)
+    partial = FakeProvider("partial", [0.0], PARTIAL)
+    pool = ProviderPool([full, partial], currencies=CURRENCIES)
+
+    assert _fetch(pool).provider == "partial"
+
+
+def _serve(routes):
+    """Start a stub upstream answering ``path -> (status, headers, body)`` from *routes*."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1].decode()
+                status, headers, body = routes.get(path, (404, {}, b""))
+                lines = [f"HTTP/1.1 {status} Stub", f"Content-Length: {len(body)}"]
+                lines += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+                # Dribble the body so streaming parsers see it in several pieces.
+                for start in range(0, len(body), 256):
+                    writer.write(body[start:start + 256])
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def _fetch_from_stub(routes, make_provider):
+    """Fetch from a stub upstream; return the provider and its quotes or the exception it raised."""
+
+    async def scenario():
+        server = await _serve(routes)
+        port = server.sockets[0].getsockname()[1]
+        fetcher = RateFetcher(request_timeout=5.0)
+        provider = make_provider(f"http://127.0.0.1:{port}")
+        try:
+            return provider, await provider.fetch(fetcher)
+        except ProviderError as exc:
+            return provider, exc
+        finally:
+            await fetcher.aclose()
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(scenario())
+
+
+def _json(document):
+    return 200, {"Content-Type": "application/json"}, json.dumps(document).encode()
+
+
+def _exchangerate_api(base):
+    return ExchangeRateApiProvider("KEY", base_url=f"{base}/v6/")
+
+
+def test_cbr_provider_parses_cp1251_nominal_and_comma_decimals():
+    routes = {
+        "/scripts/XML_daily.asp": (
+            200,
+            {"Content-Type": "application/xml; charset=windows-1251"},
+            (FIXTURES / "cbr_daily.xml").read_bytes(),
+        )
+    }
+    _, quotes = _fetch_from_stub(routes, lambda base: CbrDailyProvider(url=f"{base}/scripts/XML_daily.asp"))
+
+    assert quotes.provider == "cbr.ru"
+    assert quotes.reference == "RUB"
+    assert quotes.quotes["RUB"] == 1.0
+    assert quotes.quotes["USD"] == pytest.approx(1 / 80.0)
+    assert quotes.quotes["EUR"] == pytest.approx(1 / 93.5)
+    # 53,33 RUB per 100 JPY and 112,5 RUB per 10 CNY.
+    assert quotes.quotes["JPY"] == pytest.approx(100 / 53.33)
+    assert quotes.quotes["CNY"] == pytest.approx(10 / 112.5)
+
+
+def test_cbr_provider_rejects_a_document_without_rates():
+    routes = {"/empty.xml": (200, {}, b'<?xml version="1.0" encoding="windows-1251"?><ValCurs/>')}
+    provider, outcome = _fetch_from_stub(routes, lambda base: CbrDailyProvider(url=f"{base}/empty.xml"))
+
+    assert isinstance(outcome, ProviderError)
+    assert not provider.health.healthy()
+
+
+def test_exchangerate_api_provider_reads_conversion_rates():
+    routes = {
+        "/v6/KEY/latest/USD": _json(
+            {"result": "success", "base_code": "USD", "conversion_rates": {"USD": 1, "EUR": 0.92, "RUB": 80.5}}
+        )
+    }
+    _, quotes = _fetch_from_stub(routes, _exchangerate_api)
+
+    assert quotes.reference == "USD"
+    assert quotes.quotes == {"USD": 1.0, "EUR": 0.92, "RUB": 80.5}
+
+
+def test_exchangerate_api_quota_reached_is_rate_limited():
+    routes = {"/v6/KEY/latest/USD": _json({"result": "error", "error-type": "quota-reached"})}
+    provider, outcome = _fetch_from_stub(routes, _exchangerate_api)
+
+    assert isinstance(outcome, RateLimitedError)
+    assert not provider.health.healthy()
+
+
+def test_http_429_is_rate_limited_with_retry_after():
+    routes = {"/v6/KEY/latest/USD": (429, {"Retry-After": "120"}, b"")}
+    provider, outcome = _fetch_from_stub(routes, _exchangerate_api)
+
+    assert isinstance(outcome, RateLimitedError)
+    assert outcome.retry_after == 120.0
+    assert provider.health.cooldown_until >= time.time() + 100
+
+
+def test_exchangerate_api_other_errors_are_provider_errors():
+    routes = {"/v6/KEY/latest/USD": _json({"result": "error", "error-type": "invalid-key"})}
+    _, outcome = _fetch_from_stub(routes, _exchangerate_api)
+
+    assert isinstance(outcome, ProviderError)
+    assert not isinstance(outcome, RateLimitedError)
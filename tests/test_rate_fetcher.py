@@ -0,0 +1,87 @@
+import asyncio
+import json
+import time
+
+from rate_fetcher import RateFetcher
+
+DELAY = 0.3
+
+
+async def _slow_stub(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answer every request with a small JSON document after ``DELAY`` seconds."""
+
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            if not head:
+                break
+            path = head.split(b" ", 2)[1].decode()
+            await asyncio.sleep(DELAY)
+            body = json.dumps({"path": path}).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _heartbeat(stop: asyncio.Event, gaps: list) -> None:
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+
+def test_slow_upstream_does_not_block_event_loop():
+    async def scenario():
+        server = await asyncio.start_server(_slow_stub, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        fetcher = RateFetcher(request_timeout=5.0)
+        stop = asyncio.Event()
+        gaps: list = []
+        ticker = asyncio.create_task(_heartbeat(stop, gaps))
+        try:
+            started = time.perf_counter()
+            documents = await asyncio.gather(
+                *(fetcher.fetch_json(f"http://127.0.0.1:{port}/rates/{n}") for n in range(5))
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            stop.set()
+            await ticker
+            await fetcher.aclose()
+            server.close()
+            await server.wait_closed()
+        return documents, elapsed, gaps
+
+    documents, elapsed, gaps = asyncio.run(scenario())
+
+    assert [doc["path"] for doc in documents] == [f"/rates/{n}" for n in range(5)]
+    # Five slow requests overlap instead of running one after another ...
+    assert elapsed < DELAY * 3
+    # ... and the loop keeps serving other tasks while they are in flight.
+    assert len(gaps) >= DELAY / 0.01 / 2
+    assert max(gaps) < 0.1
+
+
+def test_stream_bytes_yields_whole_body():
+    async def scenario():
+        server = await asyncio.start_server(_slow_stub, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        fetcher = RateFetcher()
+        try:
+            chunks = [chunk async for chunk in fetcher.stream_bytes(f"http://127.0.0.1:{port}/xml", chunk_size=4)]
+        finally:
+            await fetcher.aclose()
+            server.close()
+            await server.wait_closed()
+        return b"".join(chunks)
+
+    assert json.loads(asyncio.run(scenario())) == {"path": "/xml"}
@@ -0,0 +1,25 @@
+from rates import build_cross_matrix, check_drift
+
+CURRENCIES = ("USD", "EUR", "RUB", "JPY")
+QUOTES = {"USD": 1.0, "EUR": 0.9, "RUB": 80.0, "JPY": 150.0}
+
+
+def test_steady_quotes_do_not_drift():
+    previous = build_cross_matrix(QUOTES, CURRENCIES)
+    assert check_drift(previous, dict(QUOTES, RUB=82.0), "USD") == []
+    assert check_drift(None, QUOTES, "USD") == []
+
+
+def test_jump_against_previous_snapshot_is_reported():
+    previous = build_cross_matrix(QUOTES, CURRENCIES)
+    issues = check_drift(previous, dict(QUOTES, JPY=1.5), "USD")
+    assert len(issues) == 1
+    assert issues[0].startswith("USD/JPY")
+
+
+def test_drift_is_checked_through_another_providers_reference():
+    # The previous snapshot came from a USD-based source, the new answer is RUB-based.
+    previous = build_cross_matrix(QUOTES, CURRENCIES)
+    rub_quotes = {code: value / QUOTES["RUB"] for code, value in QUOTES.items()}
+    assert check_drift(previous, rub_quotes, "RUB") == []
+    assert len(check_drift(previous, dict(rub_quotes, EUR=0.5), "RUB")) == 1
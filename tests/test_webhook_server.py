@@ -0,0 +1,130 @@
+import asyncio
+import json
+from pathlib import Path
+
+from telegram.ext import ApplicationBuilder
+
+from webhook_server import MAX_BODY_SIZE, MAX_HEADERS, SECRET_HEADER, WebhookServer
+
+UPDATES = json.loads((Path(__file__).parent / "fixtures" / "updates.json").read_text(encoding="utf-8"))
+SECRET = "s3cr3t"
+
+
+def _post(path, body, *, secret=SECRET, extra=()):
+    headers = [f"POST {path} HTTP/1.1", "Host: localhost", "Content-Type: application/json"]
+    if secret is not None:
+        headers.append(f"{SECRET_HEADER}: {secret}")
+    headers.extend(extra)
+    headers.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + body
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        return None, b""
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", "0")))
+    return int(status_line.split()[1]), body
+
+
+def _run(scenario, **options):
+    async def main():
+        application = ApplicationBuilder().token("123456:TEST").updater(None).build()
+        server = WebhookServer(
+            application, host="127.0.0.1", port=0, path="/telegram", secret_token=SECRET, **options
+        )
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            try:
+                return await scenario(application, reader, writer)
+            finally:
+                writer.close()
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_recorded_updates_are_queued_over_one_connection():
+    async def scenario(application, reader, writer):
+        statuses = []
+        for update in UPDATES:
+            writer.write(_post("/telegram", json.dumps(update).encode()))
+            await writer.drain()
+            statuses.append(await _read_response(reader))
+        queued = [application.update_queue.get_nowait() for _ in range(application.update_queue.qsize())]
+        return statuses, queued
+
+    statuses, queued = _run(scenario)
+
+    assert statuses == [(200, b"ok")] * len(UPDATES)
+    assert [update.update_id for update in queued] == [update["update_id"] for update in UPDATES]
+    assert queued[0].message.text == "/start"
+    assert queued[1].callback_query.data == "base:USD"
+    assert queued[2].effective_user.id == 210394871
+    assert queued[3].inline_query.query == "100 usd rub"
+
+
+def test_rejections():
+    async def scenario(application, reader, writer):
+        results = []
+        for request in (
+            _post("/telegram", json.dumps(UPDATES[0]).encode(), secret="wrong"),
+            _post("/telegram", b"{not json"),
+            _post("/other", b"{}"),
+            b"GET /telegram HTTP/1.1\r\nHost: localhost\r\n\r\n",
+            b"GET /healthz HTTP/1.1\r\nHost: localhost\r\n\r\n",
+        ):
+            writer.write(request)
+            await writer.drain()
+            results.append(await _read_response(reader))
+        return results, application.update_queue.qsize()
+
+    results, queued = _run(scenario)
+
+    assert [status for status, _ in results] == [403, 400, 404, 405, 200]
+    assert queued == 0
+
+
+def test_oversized_body_gets_413_without_being_read():
+    async def scenario(application, reader, writer):
+        writer.write(
+            b"POST /telegram HTTP/1.1\r\nHost: localhost\r\n"
+            + f"Content-Length: {MAX_BODY_SIZE + 1}\r\n\r\n".encode()
+        )
+        await writer.drain()
+        response = await _read_response(reader)
+        return response, await reader.read()
+
+    (status, _), rest = _run(scenario)
+
+    assert status == 413
+    assert rest == b""  # and the connection is closed
+
+
+def test_too_many_headers_get_431():
+    async def scenario(application, reader, writer):
+        extra = [f"X-Filler: {n}" for n in range(MAX_HEADERS + 1)]
+        writer.write(_post("/telegram", b"{}", extra=extra))
+        await writer.drain()
+        return await _read_response(reader)
+
+    assert _run(scenario)[0] == 431
+
+
+def test_slow_request_gets_408_and_idle_connection_is_closed():
+    async def slow(application, reader, writer):
+        writer.write(b"POST /telegram HTTP/1.1\r\nContent-Length: 10\r\n\r\n{")
+        await writer.drain()
+        return await asyncio.wait_for(_read_response(reader), 2)
+
+    async def idle(application, reader, writer):
+        return await asyncio.wait_for(reader.read(), 2)
+
+    assert _run(slow, read_timeout=0.2)[0] == 408
+    assert _run(idle, idle_timeout=0.2) == b""
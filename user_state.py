@@ -0,0 +1,255 @@
+"""SQLite-backed python-telegram-bot persistence for compact per-user state."""
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+
+class UserRecord:
+    """Compact storage form of one user's ``user_data``.
+
+    The keys the bot uses itself get a dedicated slot/column; anything else
+    is kept as JSON in ``extra``.
+    """
+
+    __slots__ = ("selected_base", "conversion_base", "conversion_target", "extra")
+
+    def __init__(
+        self,
+        selected_base: Optional[str] = None,
+        conversion_base: Optional[str] = None,
+        conversion_target: Optional[str] = None,
+        extra: Optional[str] = None,
+    ) -> None:
+        self.selected_base = selected_base
+        self.conversion_base = conversion_base
+        self.conversion_target = conversion_target
+        self.extra = extra
+
+    @classmethod
+    def from_user_data(cls, data: Dict[str, Any]) -> "UserRecord":
+        rest = {key: value for key, value in data.items() if key not in ("selected_base", "conversion")}
+        conversion = data.get("conversion") or {}
+        return cls(
+            selected_base=data.get("selected_base"),
+            conversion_base=conversion.get("base"),
+            conversion_target=conversion.get("target"),
+            extra=json.dumps(rest, ensure_ascii=False, separators=(",", ":")) if rest else None,
+        )
+
+    def to_user_data(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = json.loads(self.extra) if self.extra else {}
+        if self.selected_base is not None:
+            data["selected_base"] = self.selected_base
+        if self.conversion_base is not None and self.conversion_target is not None:
+            data["conversion"] = {"base": self.conversion_base, "target": self.conversion_target}
+        return data
+
+    def as_row(self) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+        return self.selected_base, self.conversion_base, self.conversion_target, self.extra
+
+    def is_empty(self) -> bool:
+        return not any(self.as_row())
+
+
+class UserStatePersistence(BasePersistence):
+    """Persist only ``user_data``, lazily and in batches.
+
+    * Nothing is loaded at startup; a user's record is read from SQLite the
+      first time one of their updates is processed (``refresh_user_data``).
+    * Changed records are collected by ``update_user_data`` and written in one
+      transaction per ``update_interval``.
+    * :meth:`evict` drops idle users (and the least recently used ones beyond
+      ``capacity``) from the Application's memory after persisting them, so
+      memory tracks active users rather than every user ever seen.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        update_interval: float = 30.0,
+        capacity: int = 10_000,
+        idle_ttl: float = 3600.0,
+    ) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._recent: "OrderedDict[int, float]" = OrderedDict()
+        self._pending: Dict[int, Optional[UserRecord]] = {}
+        self._evicted: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # --- SQLite -----------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "user_id INTEGER PRIMARY KEY, selected_base TEXT, conversion_base TEXT, "
+                "conversion_target TEXT, extra TEXT, updated_at INTEGER NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _load(self, user_id: int) -> Optional[UserRecord]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT selected_base, conversion_base, conversion_target, extra FROM user_state WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        return UserRecord(*row) if row else None
+
+    def _write(self, batch: Dict[int, Optional[UserRecord]]) -> None:
+        now = int(time.time())
+        upserts = [(user_id, *record.as_row(), now) for user_id, record in batch.items() if record is not None]
+        deletes = [(user_id,) for user_id, record in batch.items() if record is None]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if upserts:
+                    conn.executemany(
+                        "INSERT INTO user_state (user_id, selected_base, conversion_base, conversion_target, "
+                        "extra, updated_at) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+                        "selected_base = excluded.selected_base, conversion_base = excluded.conversion_base, "
+                        "conversion_target = excluded.conversion_target, extra = excluded.extra, "
+                        "updated_at = excluded.updated_at",
+                        upserts,
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM user_state WHERE user_id = ?", deletes)
+
+    async def _flush_pending(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        await asyncio.to_thread(self._write, batch)
+
+    # --- BasePersistence: user_data -----------------------------------------------
+
+    async def get_user_data(self) -> Dict[int, Dict[str, Any]]:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        if user_id in self._recent:
+            self._recent.move_to_end(user_id)
+            self._recent[user_id] = time.monotonic()
+            return
+        self._recent[user_id] = time.monotonic()
+        if user_data:
+            return
+        if user_id in self._pending:
+            record = self._pending[user_id]
+        else:
+            record = await asyncio.to_thread(self._load, user_id)
+        if record is not None:
+            user_data.update(record.to_user_data())
+
+    async def update_user_data(self, user_id: int, data: Dict[str, Any]) -> None:
+        record = UserRecord.from_user_data(data)
+        self._pending[user_id] = None if record.is_empty() else record
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._deferred_flush())
+
+    async def _deferred_flush(self) -> None:
+        # Application.update_persistence hands over all changed users at once;
+        # yielding once lets the whole batch arrive before the single write.
+        await asyncio.sleep(0)
+        await self._flush_pending()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._evicted:
+            # Dropped from memory by evict(); the stored record must survive.
+            self._evicted.discard(user_id)
+            return
+        self._recent.pop(user_id, None)
+        self._pending[user_id] = None
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def evict(self, application: Application) -> int:
+        """Persist and drop idle / least recently used users from ``application.user_data``."""
+
+        await self._flush_pending()
+        cutoff = time.monotonic() - self.idle_ttl
+        victims: List[int] = [user_id for user_id, seen in self._recent.items() if seen < cutoff]
+        overflow = len(self._recent) - len(victims) - self.capacity
+        if overflow > 0:
+            idle = set(victims)
+            remaining = (user_id for user_id in self._recent if user_id not in idle)
+            victims.extend(next(remaining) for _ in range(overflow))
+
+        batch: Dict[int, Optional[UserRecord]] = {}
+        for user_id in victims:
+            self._recent.pop(user_id, None)
+            data = application.user_data.get(user_id)
+            if data is None:
+                continue
+            record = UserRecord.from_user_data(deepcopy(data))
+            batch[user_id] = None if record.is_empty() else record
+            self._evicted.add(user_id)
+            application.drop_user_data(user_id)
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+        return len(batch)
+
+    # --- BasePersistence: everything else is not stored --------------------------
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Any, Any]:
+        return {}
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        return None
+
+    async def update_bot_data(self, data: Any) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        return None
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        return None
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        return None
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        return None
@@ -0,0 +1,202 @@
+"""Minimal asyncio HTTP server that feeds Telegram webhook updates into an Application."""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADERS = 64
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable",
+}
+
+
+class _RequestError(Exception):
+    """A request that is answered with *status* and then the connection is closed."""
+
+    def __init__(self, status: int, payload: bytes) -> None:
+        super().__init__(payload.decode())
+        self.status = status
+        self.payload = payload
+
+
+class WebhookServer:
+    """Accept ``POST <path>`` from Telegram and expose ``/healthz`` and ``/readyz``.
+
+    Updates are only parsed and put on ``application.update_queue``; the
+    Application processes them with its own ``concurrent_updates`` setting,
+    so Telegram gets its ``200 OK`` without waiting for the handlers.
+
+    With ``path=None`` no updates are accepted, and with ``metrics`` set the
+    rendered text is served on ``GET /metrics`` — together that is the
+    separate, usually loopback-only, metrics listener.
+
+    A kept-alive connection is closed after ``idle_timeout`` seconds without a
+    new request; a request must arrive in full within ``read_timeout``
+    seconds (408 otherwise).  More than ``MAX_HEADERS`` headers are answered
+    with 431 and a body over ``MAX_BODY_SIZE`` with 413, without reading it.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        *,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        path: Optional[str] = "/telegram",
+        secret_token: Optional[str] = None,
+        readiness: Optional[Callable[[], bool]] = None,
+        metrics: Optional[Callable[[], str]] = None,
+        read_timeout: float = 10.0,
+        idle_timeout: float = 60.0,
+    ) -> None:
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.readiness = readiness or (lambda: True)
+        self.metrics = metrics
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        sockets = self._server.sockets or ()
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # Closing the sockets ends idle keep-alive connections cleanly instead of cancelling them.
+        for writer in self._connections.values():
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=5)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, target, headers, body = await asyncio.wait_for(
+                        self._read_request(reader, request_line), self.read_timeout
+                    )
+                except asyncio.TimeoutError:
+                    await self._reject(writer, 408, b"request timeout")
+                    break
+                except _RequestError as exc:
+                    await self._reject(writer, exc.status, exc.payload)
+                    break
+                status, payload = await self._dispatch(method, target, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, payload, keep_alive=keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(
+        reader: asyncio.StreamReader, request_line: bytes
+    ) -> Tuple[str, str, Dict[str, str], bytes]:
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise _RequestError(400, b"bad request")
+        method, target, _ = parts
+        headers: Dict[str, str] = {}
+        count = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            count += 1
+            if count > MAX_HEADERS:
+                raise _RequestError(431, b"too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise _RequestError(400, b"bad content-length") from None
+        if length < 0:
+            raise _RequestError(400, b"bad content-length")
+        if length > MAX_BODY_SIZE:
+            raise _RequestError(413, b"payload too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes]:
+        path = target.split("?", 1)[0]
+        if path == "/healthz":
+            return 200, b"ok"
+        if path == "/readyz":
+            return (200, b"ready") if self.readiness() else (503, b"not ready")
+        if path == "/metrics" and self.metrics is not None:
+            return 200, self.metrics().encode("utf-8")
+        if self.path is None or path != self.path:
+            return 404, b"not found"
+        if method != "POST":
+            return 405, b"method not allowed"
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            return 403, b"forbidden"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as exc:
+            logger.warning("Некорректное обновление от Telegram: %s", exc)
+            return 400, b"bad update"
+        if update is None:
+            return 400, b"bad update"
+        await self.application.update_queue.put(update)
+        return 200, b"ok"
+
+    @classmethod
+    async def _reject(cls, writer: asyncio.StreamWriter, status: int, payload: bytes) -> None:
+        cls._write_response(writer, status, payload, keep_alive=False)
+        await writer.drain()
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, payload: bytes, *, keep_alive: bool) -> None:
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)